@@ -742,6 +742,13 @@ AWS_SECRET_ACCESS_KEY = "minio123"
 AWS_SESSION_TOKEN = ""
 AWS_S3_ENDPOINT_URL = "http://minio:9000"
 AWS_S3_BUCKET = "mapdump"
+# Presigned S3 urls are valid for S3_URL_EXPIRES seconds and reused by a
+# process for S3_URL_CACHE_TIMEOUT seconds
+S3_MAX_POOL_CONNECTIONS = 20
+S3_URL_EXPIRES = 3600  # seconds
+S3_URL_CACHE_TIMEOUT = 600  # seconds
+S3_URL_CACHE_SIZE = 10000
+
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 
 
@@ -758,8 +765,81 @@ CACHES = {
     },
 }
 
+# Concurrent image cache misses wait for the first one to render the image
+CACHE_LOCK_TIMEOUT = 60  # seconds
+CACHE_LOCK_WAIT_TIMEOUT = 30  # seconds
+
+# Map thumbnails, output size and size of the region cropped at the center
+# of the map, in pixels
+MAP_THUMBNAIL_SIZES = {
+    "thumb": ((256, 256), (512, 512)),
+    "og_thumb": ((1200, 630), (600, 315)),
+}
+
+# Browsers and shared caches may reuse public images and GPX files for
+# that long, private ones are always revalidated
+HTTP_CACHE_MAX_AGE = 24 * 3600  # seconds
+
+# Smallest tolerance, in meters, of the simplified route tracks served with
+# `?simplify=` or `?max_points=`
+ROUTE_SIMPLIFY_MIN_TOLERANCE = 1
+# Largest GPX or TCX file accepted in place of route_data, in points
+ROUTE_IMPORT_MAX_POINTS = 200000
+# Tolerance, in meters, of the track drawn on route images, None for the
+# full track. Simplified tracks have fewer time markers and smoother speeds.
+ROUTE_RENDER_SIMPLIFY_TOLERANCE = None
+
+# Maps overview clusters group the maps of 1/2**MAP_CLUSTERS_CELL_ZOOM of a
+# tile side. A request may cover up to MAP_CLUSTERS_MAX_TILES tiles. Cached
+# clusters are dropped when one of their maps changes, or expire.
+MAP_CLUSTERS_CELL_ZOOM = 3
+MAP_CLUSTERS_MAX_TILES = 256
+MAP_CLUSTERS_CACHE_TIMEOUT = 3600  # seconds
+
+# Number of map images downloaded ahead while writing an account export
+EXPORT_S3_CONCURRENCY = 4
+# Accounts with more routes or maps than these are only exported through
+# the background archive, the streamed export must end within the uWSGI
+# harakiri timeout
+EXPORT_SYNC_MAX_ROUTES = 200
+EXPORT_SYNC_MAX_MAPS = 50
+
+# Timezones are looked up at coordinates rounded to TZ_CACHE_GRID degrees
+# (~100m) and the last TZ_CACHE_SIZE results are kept by each process.
+# TZ_FINDER_IN_MEMORY reads the ~50MB of timezone polygons in memory
+# instead of from their files.
+TZ_CACHE_GRID = 0.001  # degrees
+TZ_CACHE_SIZE = 10000
+TZ_FINDER_IN_MEMORY = False
+# Countries are those of the nearest town, looked up at coordinates rounded
+# to COUNTRY_CACHE_GRID degrees (~1km)
+COUNTRY_CACHE_GRID = 0.01  # degrees
+COUNTRY_CACHE_SIZE = 10000
+# Load the timezone and country finders once in the uWSGI master, shared by
+# all its workers, rather than in every worker on its first lookup
+PRELOAD_GEODATA = True
+
+# Jobs run by the `run_background_jobs` command
+BACKGROUND_JOB_TIMEOUT = 600  # seconds before a running job is retried
+BACKGROUND_JOB_MAX_ATTEMPTS = 3
+# A failed job is retried after this delay, doubled at each further attempt
+BACKGROUND_JOB_RETRY_DELAY = 60  # seconds
+
 NODEJS_PATH = "node"
 YARN_PATH = "yarn"
+
+# Route images are drawn either in process with Pillow ("python") or by a
+# pool of long lived node processes ("node")
+ROUTE_RENDER_ENGINE = "node"
+# Node processes per uWSGI worker, which renders one image at a time
+RENDER_POOL_SIZE = 1
+RENDER_JOB_TIMEOUT = 30  # seconds
+RENDER_WORKER_MAX_JOBS = 200
+RENDER_WORKER_MAX_RSS = 512 * 2**20  # 512 megabytes
+# Each process shares its render pool stats through the cache for that long
+# after its last render
+RENDER_POOL_STATS_TIMEOUT = 24 * 3600  # seconds
+
 try:
     from .local_settings import *  # noqa: F403, F401
 except ImportError:
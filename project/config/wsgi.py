@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 application = get_wsgi_application()
+
+if settings.PRELOAD_GEODATA:
+    # Run in the uWSGI master, before it forks the workers
+    from utils.helper import preload_geodata
+
+    preload_geodata()
@@ -80,6 +80,28 @@ const scaleImage = (img, ratio) => {
   return canvas;
 };
 
+const parseRoute = (routeRaw) => {
+  return routeRaw.map((p) => {
+    return { time: p.time * 1e3, latLon: p.latlon };
+  });
+};
+
+const parseCorners = (cornersRaw) => {
+  const corners = {};
+  for (const corner of [
+    "top_left",
+    "top_right",
+    "bottom_right",
+    "bottom_left",
+  ]) {
+    corners[corner] = {
+      lat: parseFloat(cornersRaw[corner][0]),
+      lon: parseFloat(cornersRaw[corner][1]),
+    };
+  }
+  return corners;
+};
+
 const drawRoute = async (
   img,
   corners_coords,
@@ -428,4 +450,6 @@ const printTime = (t) => {
 
 module.exports = {
   drawRoute,
+  parseCorners,
+  parseRoute,
 };
@@ -0,0 +1,99 @@
+// Long lived route renderer.
+//
+// Reads jobs from stdin and writes results to stdout, one job at a time.
+// Every message is a sequence of frames, each frame being a 4 bytes big
+// endian length followed by that many bytes.
+//
+// Job:    [header JSON] [route JSON] [raw map image]
+// Result: [status JSON] [raw JPEG image]
+//
+// The header holds the map corners, the variant type (eg: "_h_r") and the
+// timezone. The status reports the outcome and the worker memory usage so
+// that the parent process can decide when to recycle it.
+const { loadImage } = require("canvas");
+const { drawRoute, parseCorners, parseRoute } = require("./drawHelpers");
+
+const FRAMES_PER_JOB = 3;
+
+let chunks = [];
+let pendingLength = 0;
+let frameLength = null;
+let frames = [];
+let busy = false;
+
+const consume = (n) => {
+  const data = chunks.length === 1 ? chunks[0] : Buffer.concat(chunks);
+  const rest = data.subarray(n);
+  chunks = rest.length ? [rest] : [];
+  pendingLength = rest.length;
+  return data.subarray(0, n);
+};
+
+const writeFrame = (data) => {
+  const length = Buffer.alloc(4);
+  length.writeUInt32BE(data.length, 0);
+  process.stdout.write(length);
+  process.stdout.write(data);
+};
+
+const writeResult = (status, data) => {
+  status.rss = process.memoryUsage().rss;
+  writeFrame(Buffer.from(JSON.stringify(status), "utf8"));
+  writeFrame(data);
+};
+
+const render = async ([headerData, routeData, imageData]) => {
+  const header = JSON.parse(headerData.toString("utf8"));
+  const route = parseRoute(JSON.parse(routeData.toString("utf8")));
+  const corners = parseCorners(header.corners);
+  const img = await loadImage(imageData);
+  const canvas = await drawRoute(
+    img,
+    corners,
+    route,
+    header.type.includes("h"),
+    header.type.includes("r"),
+    header.tz
+  );
+  return canvas.toBuffer("image/jpeg", { quality: 0.8 });
+};
+
+const processJobs = async () => {
+  if (busy) {
+    return;
+  }
+  busy = true;
+  while (frames.length >= FRAMES_PER_JOB) {
+    const job = frames.splice(0, FRAMES_PER_JOB);
+    try {
+      const data = await render(job);
+      writeResult({ ok: true }, data);
+    } catch (e) {
+      writeResult({ ok: false, error: String(e) }, Buffer.alloc(0));
+    }
+  }
+  busy = false;
+};
+
+process.stdin.on("data", (chunk) => {
+  chunks.push(chunk);
+  pendingLength += chunk.length;
+  while (true) {
+    if (frameLength === null) {
+      if (pendingLength < 4) {
+        break;
+      }
+      frameLength = consume(4).readUInt32BE(0);
+    }
+    if (pendingLength < frameLength) {
+      break;
+    }
+    frames.push(consume(frameLength));
+    frameLength = null;
+  }
+  processJobs();
+});
+
+process.stdin.on("end", () => {
+  process.exit(0);
+});
@@ -1,7 +1,8 @@
+import json
+
 from django.contrib import admin, messages
-from django.core.cache import cache
 from django.utils.translation import ngettext
-from routedb.models import RasterMap, Route, UserSettings
+from routedb.models import BackgroundJob, RasterMap, Route, UserSettings
 
 
 class RasterMapAdmin(admin.ModelAdmin):
@@ -27,14 +28,19 @@ class RouteAdmin(admin.ModelAdmin):
     list_filter = ("athlete",)
     actions = ["clear_images"]
 
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None and not obj.route_json:
+            # Edited as JSON, packed again on save
+            obj.route_json = json.dumps(obj.route)
+        return obj
+
     @admin.action(description="Clear images")
     def clear_images(self, request, qs):
         for r in qs:
-            cache.delete(f"route_{r.images_path}_h")
-            cache.delete(f"route_{r.images_path}_r")
-            cache.delete(f"route_{r.images_path}_h_r")
-            cache.delete(f"route_{r.images_path}")
-            cache.delete(f"map_{r.raster_map.image.name}_thumb")
+            r.delete_images()
+            if r.raster_map:
+                r.raster_map.delete_thumbnails()
         updated = qs.count()
 
         self.message_user(
@@ -54,6 +60,12 @@ class UserSettingsAdmin(admin.ModelAdmin):
     list_filter = ("user",)
 
 
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ("kind", "status", "creation_date", "attempts", "run_after")
+    list_filter = ("kind", "status")
+
+
+admin.site.register(BackgroundJob, BackgroundJobAdmin)
 admin.site.register(RasterMap, RasterMapAdmin)
 admin.site.register(Route, RouteAdmin)
 admin.site.register(UserSettings, UserSettingsAdmin)
@@ -0,0 +1,90 @@
+"""Clusters of the public maps, for the maps overview
+
+Each map stores the quadkey of the tile containing its center. The maps of
+a tile at a zoom level are grouped by the tiles MAP_CLUSTERS_CELL_ZOOM
+levels below it, ie: quadkeys of the same prefix, a cluster being the count
+and the mean center of the maps of one of these cells. Clusters never span
+two tiles, so they are computed and cached per tile.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Min, Q
+from django.db.models.functions import Substr
+from routedb.models import MAP_QUADKEY_ZOOM, RasterMap, Route, map_clusters_cache_key
+from utils.globalmaptiles import GlobalMercator
+
+
+def max_cluster_zoom():
+    return MAP_QUADKEY_ZOOM - settings.MAP_CLUSTERS_CELL_ZOOM
+
+
+def tiles_in_bbox(south, west, north, east, zoom, max_tiles):
+    """Quadkeys of the tiles of a zoom level covering an area, raise
+    ValueError if there are more than `max_tiles`"""
+    proj = GlobalMercator()
+    x_west, y_north = proj.latlon_to_tile({"lat": north, "lng": west}, zoom)
+    x_east, y_south = proj.latlon_to_tile({"lat": south, "lng": east}, zoom)
+    n = 2**zoom
+    # Areas crossing the antimeridian have west > east
+    nx = (x_east - x_west) % n + 1
+    if west > east and nx == 1:
+        nx = n
+    if nx * (y_south - y_north + 1) > max_tiles:
+        raise ValueError(f"More than {max_tiles} tiles")
+    return [
+        proj.tile_to_quadkey((x_west + i) % n, y, zoom)
+        for y in range(y_north, y_south + 1)
+        for i in range(nx)
+    ]
+
+
+def compute_map_clusters(quadkeys, zoom):
+    """Clusters of the public maps of tiles of the same zoom level"""
+    tiles = Q()
+    for quadkey in quadkeys:
+        tiles |= Q(quadkey__startswith=quadkey)
+    public_routes = Route.objects.filter(is_private=False)
+    cells = (
+        RasterMap.objects.filter(tiles, pk__in=public_routes.values("raster_map_id"))
+        .exclude(quadkey="")
+        .annotate(cell=Substr("quadkey", 1, zoom + settings.MAP_CLUSTERS_CELL_ZOOM))
+        .values("cell")
+        .annotate(
+            count=Count("id"),
+            lat=Avg("_latitude"),
+            lon=Avg("_longitude"),
+            uid=Min("uid"),
+        )
+        .order_by("cell")
+    )
+    clusters = {quadkey: [] for quadkey in quadkeys}
+    for cell in cells:
+        cluster = {"count": cell["count"], "lat": cell["lat"], "lon": cell["lon"]}
+        if cell["count"] == 1:
+            cluster["id"] = cell["uid"]
+        clusters[cell["cell"][:zoom]].append(cluster)
+    return clusters
+
+
+def get_map_clusters(quadkeys):
+    """Clusters of the public maps of tiles of the same zoom level, by tile
+    quadkey, cached until a map of the tile changes"""
+    keys = {quadkey: map_clusters_cache_key(quadkey) for quadkey in quadkeys}
+    try:
+        cached = cache.get_many(list(keys.values()))
+    except Exception:
+        cached = {}
+    clusters = {quadkey: cached[key] for quadkey, key in keys.items() if key in cached}
+    missing = [quadkey for quadkey in quadkeys if quadkey not in clusters]
+    if missing:
+        computed = compute_map_clusters(missing, len(missing[0]))
+        try:
+            cache.set_many(
+                {keys[quadkey]: value for quadkey, value in computed.items()},
+                settings.MAP_CLUSTERS_CACHE_TIMEOUT,
+            )
+        except Exception:
+            pass
+        clusters.update(computed)
+    return clusters
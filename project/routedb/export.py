@@ -0,0 +1,147 @@
+"""Export of all the routes of an athlete as a ZIP archive
+
+The archive holds, for each route, its GPX file and its metadata as JSON,
+and the original images of the maps of these routes. It is produced as a
+stream of bytes, entry by entry, and never held whole in memory.
+"""
+
+import json
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from routedb.models import RasterMap, Route
+from utils.gpx import iter_gpx
+from utils.s3 import s3_get_object, upload_to_s3
+
+
+class ZipStream(object):
+    """Unseekable file collecting what zipfile writes until it is read"""
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def read(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_path(user):
+    return f"exports/{user.id}/mapdump-export.zip"
+
+
+def map_filename(raster_map):
+    return f"maps/{raster_map.uid}.{raster_map.mime_type[6:]}"
+
+
+def route_metadata(route):
+    data = {
+        "id": route.uid,
+        "name": route.name,
+        "start_time": route.start_time.isoformat(),
+        "tz": route.tz,
+        "country": route.country,
+        "distance": route.distance,
+        "duration": route.duration,
+        "comment": route.comment,
+        "is_private": route.is_private,
+        "creation_date": route.creation_date.isoformat(),
+        "modification_date": route.modification_date.isoformat(),
+        "gpx": f"routes/{route.uid}.gpx",
+        "map": None,
+    }
+    if route.raster_map:
+        data["map"] = {
+            "file": map_filename(route.raster_map),
+            "bounds": route.raster_map.bounds,
+            "size": route.raster_map.size,
+        }
+    return data
+
+
+def iter_export(user):
+    """Yield the export archive of a user in chunks"""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+        map_ids = set()
+        routes = (
+            Route.objects.filter(athlete=user)
+            .select_related("raster_map")
+            .order_by("start_time")
+        )
+        for route in routes.iterator(chunk_size=50):
+            with archive.open(f"routes/{route.uid}.gpx", "w") as entry:
+                for chunk in iter_gpx(route.track):
+                    entry.write(chunk.encode("utf-8"))
+                    yield stream.read()
+            archive.writestr(
+                f"routes/{route.uid}.json",
+                json.dumps(route_metadata(route), indent=2),
+            )
+            yield stream.read()
+            if route.raster_map_id:
+                map_ids.add(route.raster_map_id)
+
+        # Map images are already compressed, they are stored as is
+        raster_maps = RasterMap.objects.filter(id__in=map_ids).order_by("id")
+        for raster_map, data in fetch_maps(raster_maps):
+            archive.writestr(
+                map_filename(raster_map), data, compress_type=zipfile.ZIP_STORED
+            )
+            yield stream.read()
+    yield stream.read()
+
+
+def fetch_maps(raster_maps):
+    """Yield (raster_map, image data) in order, downloading up to
+    EXPORT_S3_CONCURRENCY images ahead"""
+    concurrency = settings.EXPORT_S3_CONCURRENCY
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for raster_map in raster_maps.iterator():
+            pending.append(
+                (
+                    raster_map,
+                    executor.submit(
+                        s3_get_object, raster_map.path, settings.AWS_S3_BUCKET
+                    ),
+                )
+            )
+            if len(pending) >= concurrency:
+                raster_map, future = pending.popleft()
+                yield raster_map, future.result()
+        while pending:
+            raster_map, future = pending.popleft()
+            yield raster_map, future.result()
+
+
+def write_export(user, fp):
+    for chunk in iter_export(user):
+        fp.write(chunk)
+
+
+def build_export(user_id):
+    """Background job writing the export archive of a user to the bucket"""
+    user = User.objects.filter(id=user_id).first()
+    if user is None:
+        return
+    with tempfile.TemporaryFile() as fp:
+        write_export(user, fp)
+        fp.seek(0)
+        upload_to_s3(settings.AWS_S3_BUCKET, export_path(user), fp, "application/zip")
@@ -0,0 +1,140 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+from routedb.export import build_export
+from routedb.models import BackgroundJob, Route
+
+logger = logging.getLogger(__name__)
+
+RENDER_ROUTE = "render_route"
+EXPORT_ACCOUNT = "export_account"
+
+# (show_header, show_route) arguments of Route.route_image_path, or the
+# name of a RasterMap thumbnail size
+ROUTE_IMAGE_VARIANTS = {
+    "_h_r": (True, True),
+    "_h": (True, False),
+    "_r": (False, True),
+    "": (False, False),
+}
+MAP_IMAGE_VARIANTS = {"thumbnail": "thumb", "og_thumbnail": "og_thumb"}
+IMAGE_VARIANTS = list(ROUTE_IMAGE_VARIANTS) + list(MAP_IMAGE_VARIANTS)
+
+
+def enqueue(kind, **payload):
+    if BackgroundJob.objects.filter(
+        kind=kind, payload=payload, status=BackgroundJob.PENDING
+    ).exists():
+        return
+    # A concurrent enqueue may have created the same job since, the unique
+    # constraint on pending jobs rejects the duplicate
+    try:
+        with transaction.atomic():
+            BackgroundJob.objects.create(kind=kind, payload=payload)
+    except IntegrityError:
+        pass
+
+
+def enqueue_route_render(route):
+    """Schedule the rendering of every image of a route"""
+
+    def enqueue_all():
+        for variant in IMAGE_VARIANTS:
+            enqueue(RENDER_ROUTE, route_id=route.id, variant=variant)
+
+    transaction.on_commit(enqueue_all)
+
+
+def variant_cache_key(route, variant):
+    if variant in MAP_IMAGE_VARIANTS:
+        return route.raster_map.thumbnail_cache_key(MAP_IMAGE_VARIANTS[variant])
+    return route.image_cache_key(variant)
+
+
+def render_route_variant(route, variant):
+    if variant in MAP_IMAGE_VARIANTS:
+        route.raster_map.get_thumbnail_path(MAP_IMAGE_VARIANTS[variant])
+    else:
+        route.route_image_path(*ROUTE_IMAGE_VARIANTS[variant])
+
+
+def render_route(route_id, variant):
+    route = Route.objects.select_related("raster_map").filter(id=route_id).first()
+    if route is None or route.raster_map is None:
+        return
+    render_route_variant(route, variant)
+
+
+JOB_HANDLERS = {
+    RENDER_ROUTE: render_route,
+    EXPORT_ACCOUNT: build_export,
+}
+
+
+def claim_job():
+    """Return the next job to run, marked as running, or None
+
+    Rows are locked with SKIP LOCKED so that concurrent workers never claim
+    the same job. Jobs left running by a dead worker are claimed again once
+    BACKGROUND_JOB_TIMEOUT has passed, or marked as failed if they already
+    had BACKGROUND_JOB_MAX_ATTEMPTS. Jobs which raised an error are retried
+    once their retry delay has passed.
+    """
+    current_date = now()
+    stale_date = current_date - timedelta(seconds=settings.BACKGROUND_JOB_TIMEOUT)
+    # Jobs which took their worker down on every attempt are given up
+    BackgroundJob.objects.filter(
+        status=BackgroundJob.RUNNING,
+        start_date__lt=stale_date,
+        attempts__gte=settings.BACKGROUND_JOB_MAX_ATTEMPTS,
+    ).update(status=BackgroundJob.FAILED, error="Timed out")
+    with transaction.atomic():
+        job = (
+            BackgroundJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=BackgroundJob.PENDING, run_after__isnull=True)
+                | Q(status=BackgroundJob.PENDING, run_after__lte=current_date)
+                | Q(
+                    status=BackgroundJob.RUNNING,
+                    start_date__lt=stale_date,
+                    attempts__lt=settings.BACKGROUND_JOB_MAX_ATTEMPTS,
+                )
+            )
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = BackgroundJob.RUNNING
+        job.start_date = now()
+        job.attempts += 1
+        job.save(update_fields=["status", "start_date", "attempts"])
+    return job
+
+
+def run_job(job):
+    try:
+        JOB_HANDLERS[job.kind](**job.payload)
+    except Exception:
+        logger.exception("Background job %s failed", job.id)
+        if job.attempts < settings.BACKGROUND_JOB_MAX_ATTEMPTS:
+            job.status = BackgroundJob.PENDING
+            job.run_after = now() + timedelta(
+                seconds=settings.BACKGROUND_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            )
+        else:
+            job.status = BackgroundJob.FAILED
+        job.error = traceback.format_exc()
+        try:
+            with transaction.atomic():
+                job.save(update_fields=["status", "error", "run_after"])
+        except IntegrityError:
+            # The same job was enqueued again while this one ran
+            job.delete()
+        return False
+    job.delete()
+    return True
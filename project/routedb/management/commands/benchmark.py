@@ -0,0 +1,538 @@
+import json
+import math
+import multiprocessing
+import resource
+import time
+
+import arrow
+import gpxpy
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from routedb.models import RasterMap, Route
+from routedb.views import bbox_filter
+from timezonefinder import TimezoneFinder
+from utils.gps_data_encoder import (
+    YEAR2010,
+    decode_series,
+    decode_signed_number,
+    decode_unsigned_number,
+    encode_series,
+)
+from utils.gpx import iter_gpx
+from utils.helper import (
+    clear_country_cache,
+    clear_tz_cache,
+    country_at_coords_many,
+    preload_geodata,
+    tz_at_coords,
+    tz_at_coords_many,
+)
+from utils.map_renderer import (
+    MAX_MEAN_DIFF,
+    MAX_PIXELS_OFF,
+    image_difference,
+    render_route_image,
+)
+from utils.render_pool import RenderWorker
+from utils.track import Track
+from utils.track_metrics import TrackMetrics
+
+
+def python_render_child(queue, data, bounds, track, arg, tz, runs):
+    timings = []
+    out = None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        out = render_route_image(data, bounds, track, arg, tz)
+        timings.append(time.perf_counter() - t0)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    queue.put((timings, peak_rss, out))
+
+
+def memory_usage():
+    """RSS of the process and its private part, not shared with its parent
+    or other processes, in bytes"""
+    usage = {}
+    with open("/proc/self/smaps_rollup") as fp:
+        for line in fp:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                usage[name] = int(value.split()[0]) * 1024
+    return usage["Rss"], usage["Private_Clean"] + usage["Private_Dirty"]
+
+
+def geodata_child(queue, coords):
+    """A worker first lookups, loading the geodata unless preloaded"""
+    t0 = time.perf_counter()
+    tz_at_coords_many(coords)
+    country_at_coords_many(coords)
+    elapsed = time.perf_counter() - t0
+    queue.put((elapsed, *memory_usage()))
+
+
+def python_distance(points):
+    """Route distance as computed by Route.get_distance before it used
+    utils.track_metrics, the reference for accuracy"""
+    d = 0
+    prev_p = points[0]
+    c = math.pi / 180
+    for p in points[1:]:
+        dlat = p["latlon"][0] - prev_p["latlon"][0]
+        dlon = p["latlon"][1] - prev_p["latlon"][1]
+        a = (
+            math.sin(c * dlat / 2) ** 2
+            + math.cos(c * p["latlon"][0])
+            * math.cos(c * prev_p["latlon"][0])
+            * math.sin(c * dlon / 2) ** 2
+        )
+        d += 12756274 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        prev_p = p
+    return d
+
+
+def legacy_decode(encoded):
+    """GeoLocationSeries.decode_str before it decoded from offsets"""
+    result = []
+    tim = YEAR2010
+    lat = 0
+    lon = 0
+    while len(encoded) > 0:
+        tim_d, encoded = decode_unsigned_number(encoded)
+        lat_d, encoded = decode_signed_number(encoded)
+        lon_d, encoded = decode_signed_number(encoded)
+        tim += tim_d
+        lat += lat_d
+        lon += lon_d
+        result.append((tim, lat / 1e5, lon / 1e5))
+    return result
+
+
+def gpxpy_document(track):
+    """GPX document of a track as Route.gpx built it with gpxpy before it
+    used utils.gpx, the reference output"""
+    gpx = gpxpy.gpx.GPX()
+    gpx.creator = "Mapdump.com"
+    gpx_track = gpxpy.gpx.GPXTrack()
+    gpx.tracks.append(gpx_track)
+    gpx_segment = gpxpy.gpx.GPXTrackSegment()
+    for lat, lon, t in zip(
+        track.lats.tolist(), track.lons.tolist(), track.times.tolist()
+    ):
+        pt = gpxpy.gpx.GPXTrackPoint(lat, lon)
+        if t and not math.isnan(t):
+            pt.time = arrow.get(t).datetime
+        gpx_segment.points.append(pt)
+    gpx_track.segments.append(gpx_segment)
+    return gpx.to_xml()
+
+
+def random_track(n):
+    """A random walk of n points, one per second at ~3m/s"""
+    rng = np.random.default_rng(n)
+    lats = 60.0 + np.cumsum(rng.normal(0, 2e-5, n))
+    lons = 22.0 + np.cumsum(rng.normal(0, 4e-5, n))
+    times = 1.65e9 + np.arange(n, dtype=float)
+    return Track(lats, lons, times)
+
+
+class Command(BaseCommand):
+    help = "Run performance benchmarks"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="benchmark", required=True)
+        render = subparsers.add_parser(
+            "render", help="Compare the node and python route image engines"
+        )
+        render.add_argument("--route", help="uid of the route to render")
+        render.add_argument("--variant", default="_h_r")
+        render.add_argument("--runs", type=int, default=5)
+        render.add_argument(
+            "--max-mean-diff",
+            type=float,
+            default=MAX_MEAN_DIFF,
+            help="Fail if the mean difference to node output is above, /255",
+        )
+        render.add_argument(
+            "--max-pixels-off",
+            type=float,
+            default=MAX_PIXELS_OFF,
+            help="Fail if more pixels differ by >32 from node output, in %%",
+        )
+        storage = subparsers.add_parser(
+            "storage", help="Compare the JSON and binary route track storage"
+        )
+        storage.add_argument("--routes", type=int, default=100)
+        metrics = subparsers.add_parser(
+            "metrics", help="Compare the track metrics to a pure python loop"
+        )
+        metrics.add_argument(
+            "--points", type=int, nargs="+", default=[1000, 10000, 100000]
+        )
+        metrics.add_argument("--runs", type=int, default=5)
+        encoder = subparsers.add_parser(
+            "encoder", help="Time utils.gps_data_encoder on growing tracks"
+        )
+        encoder.add_argument(
+            "--points", type=int, nargs="+", default=[10000, 100000, 1000000]
+        )
+        encoder.add_argument(
+            "--legacy-max-points",
+            type=int,
+            default=20000,
+            help="Largest track also decoded the former, quadratic, way",
+        )
+
+        timezones = subparsers.add_parser(
+            "timezones", help="Time single and batched timezone lookups"
+        )
+        timezones.add_argument("--points", type=int, default=10000)
+        timezones.add_argument(
+            "--legacy-max-points",
+            type=int,
+            default=20,
+            help="Number of points also looked up with a new finder each time",
+        )
+
+        geodata = subparsers.add_parser(
+            "geodata",
+            help="Compare workers loading the geodata to workers sharing it",
+        )
+        geodata.add_argument("--workers", type=int, default=4)
+
+        bbox = subparsers.add_parser(
+            "bbox", help="Time area queries on the map bounding box columns"
+        )
+        bbox.add_argument("--rows", type=int, default=1000000)
+        bbox.add_argument("--queries", type=int, default=100)
+
+        gpx = subparsers.add_parser(
+            "gpx", help="Compare the GPX writer to gpxpy, output and timings"
+        )
+        gpx.add_argument("--points", type=int, default=30000)
+
+    def handle(self, *args, **options):
+        getattr(self, f"bench_{options['benchmark']}")(**options)
+
+    def report(self, name, timings, peak_rss=None):
+        line = (
+            f"{name}: {len(timings)} runs, "
+            f"min {min(timings) * 1e3:.1f}ms, "
+            f"mean {sum(timings) / len(timings) * 1e3:.1f}ms"
+        )
+        if peak_rss is not None:
+            line += f", peak RSS {peak_rss / 2**20:.1f}MB"
+        self.stdout.write(line)
+
+    def bench_render(
+        self,
+        route=None,
+        variant="_h_r",
+        runs=5,
+        max_mean_diff=MAX_MEAN_DIFF,
+        max_pixels_off=MAX_PIXELS_OFF,
+        **options,
+    ):
+        qs = Route.objects.filter(raster_map__isnull=False)
+        if route:
+            qs = qs.filter(uid=route)
+        route = qs.select_related("raster_map").first()
+        if route is None:
+            raise CommandError("No route found")
+        data = route.raster_map.data
+        bounds = route.raster_map.bounds
+        self.stdout.write(
+            f"Route {route.uid}: {len(route.track)} points, "
+            f"map {route.raster_map.width}x{route.raster_map.height}"
+        )
+
+        # Render in a forked process so that its peak RSS is its own
+        ctx = multiprocessing.get_context("fork")
+        queue = ctx.Queue()
+        child = ctx.Process(
+            target=python_render_child,
+            args=(queue, data, bounds, route.track, variant, route.tz, runs),
+        )
+        child.start()
+        timings, peak_rss, python_out = queue.get()
+        child.join()
+        self.report("python", timings, peak_rss)
+
+        worker = RenderWorker()
+        timings = []
+        peak_rss = 0
+        try:
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                node_out = worker.render(
+                    {"corners": bounds, "type": variant, "tz": route.tz},
+                    json.dumps(route.route).encode("utf-8"),
+                    data,
+                    60,
+                )
+                timings.append(time.perf_counter() - t0)
+                peak_rss = max(peak_rss, worker.rss)
+        finally:
+            worker.close()
+        self.report("node", timings, peak_rss)
+
+        # The node output is the reference image
+        try:
+            mean_diff, pixels_off = image_difference(node_out, python_out)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"Difference to node output: mean {mean_diff:.2f}/255, "
+            f"{pixels_off:.2f}% of pixels off by >32"
+        )
+        if mean_diff > max_mean_diff or pixels_off > max_pixels_off:
+            raise CommandError(
+                f"Python output differs too much from node output, allowed "
+                f"mean {max_mean_diff:.2f}/255 and {max_pixels_off:.2f}% of pixels"
+            )
+
+    def bench_storage(self, routes=100, **options):
+        json_size = binary_size = 0
+        json_timings = []
+        binary_timings = []
+        for route in Route.objects.order_by("-id")[:routes]:
+            route_json = json.dumps(route.route)
+            track_data = route.track.to_bytes()
+            json_size += len(route_json.encode("utf-8"))
+            binary_size += len(track_data)
+            t0 = time.perf_counter()
+            Track.from_json(route_json)
+            json_timings.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            Track.from_bytes(track_data)
+            binary_timings.append(time.perf_counter() - t0)
+        if not json_timings:
+            raise CommandError("No route found")
+        count = len(json_timings)
+        self.stdout.write(
+            f"{count} routes, JSON {json_size / count / 1024:.1f}kB per route, "
+            f"binary {binary_size / count / 1024:.1f}kB per route "
+            f"({json_size / binary_size:.1f}x smaller)"
+        )
+        self.report("JSON decode", json_timings)
+        self.report("binary decode", binary_timings)
+
+    def bench_metrics(self, points=(), runs=5, **options):
+        for n in points:
+            track = random_track(n)
+            route = track.to_points()
+            timings = []
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                expected = python_distance(route)
+                timings.append(time.perf_counter() - t0)
+            self.report(f"{n} points, python loop", timings)
+            timings = []
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                metrics = TrackMetrics(track)
+                timings.append(time.perf_counter() - t0)
+            self.report(f"{n} points, track metrics", timings)
+            self.stdout.write(
+                f"{n} points, distance {metrics.distance:.3f}m, "
+                f"difference {abs(metrics.distance - expected):.2e}m"
+            )
+
+    def bench_encoder(self, points=(), legacy_max_points=20000, **options):
+        for n in points:
+            track = random_track(n)
+            t0 = time.perf_counter()
+            encoded = encode_series(track.lats, track.lons, track.times)
+            encode_time = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            decode_series(encoded)
+            decode_time = time.perf_counter() - t0
+            line = (
+                f"{n} points, {len(encoded) / 2**20:.1f}MB, "
+                f"encode {encode_time * 1e3:.1f}ms "
+                f"({encode_time / n * 1e9:.0f}ns/point), "
+                f"decode {decode_time * 1e3:.1f}ms "
+                f"({decode_time / n * 1e9:.0f}ns/point)"
+            )
+            if n <= legacy_max_points:
+                t0 = time.perf_counter()
+                legacy_decode(encoded)
+                legacy_time = time.perf_counter() - t0
+                line += (
+                    f", former decode {legacy_time * 1e3:.1f}ms "
+                    f"({legacy_time / n * 1e9:.0f}ns/point)"
+                )
+            self.stdout.write(line)
+
+    def bench_timezones(self, points=10000, legacy_max_points=20, **options):
+        # Route starts, clustered around a few hundred venues across Europe
+        rng = np.random.default_rng(points)
+        venues = np.column_stack((rng.uniform(40, 65, 300), rng.uniform(-10, 30, 300)))
+        coords = venues[rng.integers(0, len(venues), points)]
+        coords = (coords + rng.normal(0, 0.01, coords.shape)).tolist()
+
+        timings = []
+        expected = []
+        for lat, lng in coords[:legacy_max_points]:
+            t0 = time.perf_counter()
+            expected.append(TimezoneFinder().timezone_at(lng=lng, lat=lat))
+            timings.append(time.perf_counter() - t0)
+        self.report("new finder per lookup", timings)
+
+        tz_at_coords(0, 0)  # open the finder
+        clear_tz_cache()
+        for name, lookup in (
+            ("tz_at_coords, cold cache", lambda: [tz_at_coords(*c) for c in coords]),
+            ("tz_at_coords, warm cache", lambda: [tz_at_coords(*c) for c in coords]),
+            ("tz_at_coords_many, cold cache", lambda: tz_at_coords_many(coords)),
+        ):
+            if "cold" in name:
+                clear_tz_cache()
+            t0 = time.perf_counter()
+            found = lookup()
+            elapsed = time.perf_counter() - t0
+            self.stdout.write(
+                f"{name}: {points} points in {elapsed * 1e3:.1f}ms "
+                f"({elapsed / points * 1e6:.1f}us/point)"
+            )
+        mismatches = sum(a != b for a, b in zip(found, expected))
+        self.stdout.write(
+            f"{mismatches}/{len(expected)} timezones differ from exact lookups"
+        )
+
+    def run_geodata_workers(self, name, workers, coords):
+        ctx = multiprocessing.get_context("fork")
+        queue = ctx.Queue()
+        children = [
+            ctx.Process(target=geodata_child, args=(queue, coords))
+            for _ in range(workers)
+        ]
+        for child in children:
+            child.start()
+        results = [queue.get() for _ in children]
+        for child in children:
+            child.join()
+        timings, rss, private = zip(*results)
+        self.report(f"{name}, first lookups", timings)
+        self.stdout.write(
+            f"{name}: RSS {sum(rss) / workers / 2**20:.1f}MB per worker, "
+            f"private {sum(private) / workers / 2**20:.1f}MB per worker"
+        )
+
+    def bench_geodata(self, workers=4, **options):
+        rng = np.random.default_rng(0)
+        coords = np.column_stack(
+            (rng.uniform(-60, 70, 100), rng.uniform(-180, 180, 100))
+        ).tolist()
+        # Workers forked before anything is loaded, each loads its own
+        self.run_geodata_workers("not preloaded", workers, coords)
+
+        t0 = time.perf_counter()
+        preload_geodata()
+        self.stdout.write(f"preload: {(time.perf_counter() - t0) * 1e3:.1f}ms")
+        clear_tz_cache()
+        clear_country_cache()
+        self.run_geodata_workers("preloaded", workers, coords)
+
+    def bench_bbox(self, rows=1000000, queries=100, **options):
+        rng = np.random.default_rng(rows)
+        # Maps of ~2km, a third of them in a tenth of the world
+        lats = np.where(
+            rng.random(rows) < 1 / 3,
+            rng.uniform(55, 65, rows),
+            rng.uniform(-60, 70, rows),
+        )
+        lons = rng.uniform(-180, 180 - 0.04, rows)
+        areas = np.column_stack(
+            (rng.uniform(55, 64, queries), rng.uniform(0, 30, queries))
+        )
+        with transaction.atomic():
+            user = User.objects.create(username=f"benchmark-{time.time_ns()}")
+            t0 = time.perf_counter()
+            for start in range(0, rows, 10000):
+                RasterMap.objects.bulk_create(
+                    RasterMap(
+                        uid=f"bench{i}",
+                        uploader=user,
+                        image="maps/benchmark",
+                        # Known dimensions, the image is not opened
+                        width=1000,
+                        height=1000,
+                        corners_coordinates=(
+                            f"{lat + 0.02},{lon},{lat + 0.02},{lon + 0.04},"
+                            f"{lat},{lon + 0.04},{lat},{lon}"
+                        ),
+                        country="",
+                        _latitude=lat + 0.01,
+                        _longitude=lon + 0.02,
+                        north=lat + 0.02,
+                        south=lat,
+                        east=lon + 0.04,
+                        west=lon,
+                    )
+                    for i, lat, lon in zip(
+                        range(start, start + 10000),
+                        lats[start : start + 10000].tolist(),
+                        lons[start : start + 10000].tolist(),
+                    )
+                )
+            self.stdout.write(
+                f"{rows} maps inserted in {time.perf_counter() - t0:.1f}s"
+            )
+            maps = RasterMap.objects.order_by()
+
+            def area_query(south, west):
+                return maps.filter(bbox_filter(south, west, south + 1, west + 1))
+
+            self.stdout.write(area_query(*areas[0]).values("id").explain())
+            timings = []
+            found = 0
+            for south, west in areas.tolist():
+                t0 = time.perf_counter()
+                found += len(area_query(south, west).values_list("id", flat=True))
+                timings.append(time.perf_counter() - t0)
+            self.report("1x1 degree area, bounding box columns", timings)
+            self.stdout.write(f"{found / queries:.0f} maps per area")
+
+            # Former way, parsing the corners of every map
+            south, west = areas[0].tolist()
+            t0 = time.perf_counter()
+            expected = len(area_query(south, west))
+            scanned = 0
+            for corners in maps.values_list("corners_coordinates", flat=True):
+                values = [float(x) for x in corners.split(",")]
+                if (
+                    min(values[::2]) <= south + 1
+                    and max(values[::2]) >= south
+                    and min(values[1::2]) <= west + 1
+                    and max(values[1::2]) >= west
+                ):
+                    scanned += 1
+            self.report("1x1 degree area, full scan", [time.perf_counter() - t0])
+            if scanned != expected:
+                raise CommandError(f"Found {expected} maps, expected {scanned}")
+            transaction.set_rollback(True)
+
+    def bench_gpx(self, points=30000, **options):
+        track = random_track(points)
+        # Points close to the equator and the meridian, which python writes
+        # in scientific notation, and points without time
+        edges = Track(
+            np.array([1e-05, -2.5e-07, 1e-12, 0.0, 45.0]),
+            np.array([-3e-06, 1e-05, 0.0, 1e-09, 1e-05]),
+            np.array([1.65e9, 0.0, 1.65e9 + 0.5, np.nan, 1.65e9 + 1]),
+        )
+        for name, sample in (("edge cases", edges), (f"{points} points", track)):
+            t0 = time.perf_counter()
+            expected = gpxpy_document(sample)
+            gpxpy_time = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            output = "".join(iter_gpx(sample))
+            gpx_time = time.perf_counter() - t0
+            if output != expected:
+                raise CommandError(f"{name}: output differs from gpxpy")
+            self.stdout.write(
+                f"{name}: same output as gpxpy, gpxpy {gpxpy_time * 1e3:.1f}ms, "
+                f"streamed {gpx_time * 1e3:.1f}ms"
+            )
@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from routedb.export import write_export
+from routedb.jobs import EXPORT_ACCOUNT, enqueue
+
+
+class Command(BaseCommand):
+    help = "Export the routes and maps of a user as a ZIP archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--output", help="Archive path, <username>.zip if unset")
+        parser.add_argument(
+            "--background",
+            action="store_true",
+            help="Build the archive in the map bucket with run_background_jobs",
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username__iexact=options["username"]).first()
+        if user is None:
+            raise CommandError("No such user")
+        if options["background"]:
+            enqueue(EXPORT_ACCOUNT, user_id=user.id)
+            self.stdout.write(self.style.SUCCESS("Export scheduled"))
+            return
+        output = options["output"] or f"{user.username}.zip"
+        with open(output, "wb") as fp:
+            write_export(user, fp)
+        self.stdout.write(self.style.SUCCESS(f"Exported to {output}"))
@@ -1,13 +1,23 @@
 from django.core.management.base import BaseCommand
 from routedb.models import RasterMap
+from utils.helper import country_at_coords_many
+
+BATCH_SIZE = 1000
 
 
 class Command(BaseCommand):
     help = "fill auto generated field"
 
     def handle(self, *args, **options):
-        qs = RasterMap.objects.all()
-        for r in qs:
-            r.prefetch_map_extras()
-            r.save()
+        qs = RasterMap.objects.order_by("id")
+        last_id = 0
+        while True:
+            maps = list(qs.filter(id__gt=last_id)[:BATCH_SIZE])
+            if not maps:
+                break
+            countries = country_at_coords_many([r.get_center() for r in maps])
+            for r, country in zip(maps, countries):
+                r.prefetch_map_extras(country=country)
+                r.save()
+            last_id = maps[-1].id
         self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from routedb.models import RasterMap, Route
+
+BBOX_FIELDS = ["north", "south", "east", "west"]
+
+
+class Command(BaseCommand):
+    help = "Fill the bounding boxes of the maps and routes and the quadkeys of the maps"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        maps = RasterMap.objects.filter(Q(south__isnull=True) | Q(quadkey="")).only(
+            "id", "corners_coordinates", "_latitude", "_longitude"
+        )
+        self.fill(maps, batch_size, "maps", BBOX_FIELDS + ["quadkey"])
+        routes = Route.objects.filter(south__isnull=True).only(
+            "id", "route_json", "track_data"
+        )
+        self.fill(routes, batch_size, "routes", BBOX_FIELDS)
+        self.stdout.write(self.style.SUCCESS("Done"))
+
+    def fill(self, qs, batch_size, name, fields):
+        last_id = 0
+        filled = 0
+        while True:
+            batch = list(qs.filter(id__gt=last_id).order_by("id")[:batch_size])
+            if not batch:
+                break
+            for obj in batch:
+                obj.update_bbox()
+                if "quadkey" in fields:
+                    obj.update_quadkey()
+            # bulk_update() leaves modification_date, and so the etags, as is
+            qs.model.objects.bulk_update(batch, fields)
+            filled += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"{filled} {name} filled")
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from routedb.models import Route
+from utils.track import Track
+
+
+class Command(BaseCommand):
+    help = "Move the route points stored as JSON to the binary track column"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_id = 0
+        packed = 0
+        saved = 0
+        while True:
+            batch = list(
+                Route.objects.exclude(route_json="")
+                .filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "route_json")[:batch_size]
+            )
+            if not batch:
+                break
+            for route_id, route_json in batch:
+                track_data = Track.from_json(route_json).to_bytes()
+                # update() leaves modification_date, and so the etags, as is
+                Route.objects.filter(id=route_id).update(
+                    track_data=track_data, route_json=""
+                )
+                packed += 1
+                saved += len(route_json.encode("utf-8")) - len(track_data)
+            last_id = batch[-1][0]
+            self.stdout.write(f"{packed} routes packed")
+        self.stdout.write(
+            self.style.SUCCESS(f"Done, {packed} routes, {saved / 2**20:.1f}MB saved")
+        )
@@ -1,23 +1,111 @@
+import multiprocessing
+import os
+import time
+
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils.dateparse import parse_date
+from routedb.jobs import IMAGE_VARIANTS, render_route_variant, variant_cache_key
 from routedb.models import Route
 
 
+def refill_route(args):
+    route_id, only_missing = args
+    route = Route.objects.select_related("raster_map").filter(id=route_id).first()
+    if route is None or route.raster_map is None:
+        return route_id, 0
+    rendered = 0
+    for variant in IMAGE_VARIANTS:
+        if only_missing and cache.has_key(variant_cache_key(route, variant)):
+            continue
+        render_route_variant(route, variant)
+        rendered += 1
+    return route_id, rendered
+
+
 class Command(BaseCommand):
-    help = "Remove image cache"
+    help = "Fill the image cache of routes"
 
-    def generate_thumb(self, route):
-        _ = route.raster_map.thumbnail
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=1, help="Number of processes to use"
+        )
+        parser.add_argument(
+            "--since", help="Only routes created on or after this date (YYYY-MM-DD)"
+        )
+        parser.add_argument("--athlete", help="Only routes of this username")
+        parser.add_argument(
+            "--only-missing",
+            action="store_true",
+            help="Skip images already in cache",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="File storing the last processed route id, "
+            "processing resumes after it when the file exists",
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
 
-    def generate_map(self, route, show_header, show_route):
-        _ = route.route_image(show_header, show_route)
+    def read_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return None
+        with open(path) as fp:
+            return int(fp.read().strip() or 0)
+
+    def write_checkpoint(self, path, route_id):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as fp:
+            fp.write(str(route_id))
+        os.replace(tmp_path, path)
 
     def handle(self, *args, **options):
-        qs = Route.objects.all()
-        for r in qs:
-            print("Processing route: {} by {}".format(r.name, r.athlete))
-            self.generate_thumb(r)
-            self.generate_map(r, True, False)
-            self.generate_map(r, True, True)
-            self.generate_map(r, False, True)
-            self.generate_map(r, False, False)
+        qs = Route.objects.filter(raster_map__isnull=False).order_by("id")
+        if options["since"]:
+            qs = qs.filter(creation_date__date__gte=parse_date(options["since"]))
+        if options["athlete"]:
+            qs = qs.filter(athlete__username__iexact=options["athlete"])
+        last_id = self.read_checkpoint(options["checkpoint"])
+        if last_id:
+            self.stdout.write(f"Resuming after route id {last_id}")
+            qs = qs.filter(id__gt=last_id)
+
+        total = qs.count()
+        tasks = (
+            (route_id, options["only_missing"])
+            for route_id in qs.values_list("id", flat=True).iterator(
+                chunk_size=options["chunk_size"]
+            )
+        )
+        pool = None
+        if options["workers"] > 1:
+            # Forked processes must not share the parent database connection
+            connections.close_all()
+            pool = multiprocessing.get_context("fork").Pool(options["workers"])
+            results = pool.imap(refill_route, tasks)
+        else:
+            results = map(refill_route, tasks)
+
+        t0 = time.monotonic()
+        done = rendered = 0
+        try:
+            # Results are yielded in order, the checkpoint never skips a route
+            for route_id, route_rendered in results:
+                done += 1
+                rendered += route_rendered
+                if options["checkpoint"]:
+                    self.write_checkpoint(options["checkpoint"], route_id)
+                elapsed = time.monotonic() - t0
+                rate = done / elapsed if elapsed else 0
+                eta = (total - done) / rate if rate else 0
+                self.stdout.write(
+                    f"\r{done}/{total} routes, {rendered} images, "
+                    f"{rate:.2f} routes/s, ETA {eta:.0f}s",
+                    ending="",
+                )
+                self.stdout.flush()
+        finally:
+            if pool is not None:
+                pool.terminate()
+        self.stdout.write("")
         self.stdout.write(self.style.SUCCESS("Done"))
@@ -1,4 +1,3 @@
-from django.core.cache import cache
 from django.core.management.base import BaseCommand
 from routedb.models import Route
 
@@ -7,11 +6,9 @@ class Command(BaseCommand):
     help = "Remove image cache"
 
     def handle(self, *args, **options):
-        qs = Route.objects.all()
+        qs = Route.objects.all().select_related("raster_map")
         for r in qs:
-            cache.delete(f"route_{r.images_path}_h")
-            cache.delete(f"route_{r.images_path}_r")
-            cache.delete(f"route_{r.images_path}_h_r")
-            cache.delete(f"route_{r.images_path}")
-            cache.delete(f"map_{r.raster_map.image.name}_thumb")
+            r.delete_images()
+            if r.raster_map:
+                r.raster_map.delete_thumbnails()
         self.stdout.write(self.style.SUCCESS("Done"))
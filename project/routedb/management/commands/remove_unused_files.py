@@ -1,12 +1,26 @@
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from routedb.models import ROUTE_IMAGE_VARIANTS, Route, route_image_path
 from utils.s3 import get_s3_client, s3_delete_key
 
 
 class Command(BaseCommand):
     help = "Remove image file from prev version"
 
+    def live_route_images(self):
+        """Paths of the rendered images of the existing routes"""
+        paths = set()
+        for uid in Route.objects.values_list("uid", flat=True).iterator():
+            route = Route(uid=uid)
+            paths.update(route_image_path(route, arg) for arg in ROUTE_IMAGE_VARIANTS)
+        return paths
+
     def scan_map_directory(self):
+        # Files uploaded once the scan started may belong to routes created
+        # since the live images were listed
+        started = now()
+        live_images = self.live_route_images()
         # Should use v2 but wasabi fails to list all files with it
         # paginator = s3.get_paginator('list_objects_v2')
         paginator = self.s3.get_paginator("list_objects")
@@ -21,6 +35,8 @@ class Command(BaseCommand):
                 break
             for obj in contents:
                 key = obj["Key"]
+                if key in live_images or obj["LastModified"] >= started:
+                    continue
                 yield key
 
     def handle(self, *args, **options):
@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand
+from routedb.test_data import REFERENCE_VARIANTS, reference_path, render_fixture
+from utils.render_pool import RenderWorker
+
+
+class Command(BaseCommand):
+    help = "Draw the reference route images of the tests with the node renderer"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--variant", nargs="+", default=list(REFERENCE_VARIANTS))
+
+    def handle(self, *args, **options):
+        map_data, corners, track, tz = render_fixture()
+        worker = RenderWorker()
+        try:
+            for variant in options["variant"]:
+                image = worker.render(
+                    {"corners": corners, "type": variant, "tz": tz},
+                    json.dumps(track.to_points()).encode("utf-8"),
+                    map_data,
+                    60,
+                )
+                path = reference_path(variant)
+                with open(path, "wb") as fp:
+                    fp.write(image)
+                self.stdout.write(f"Written {path}")
+        finally:
+            worker.close()
+        self.stdout.write(self.style.SUCCESS("Done"))
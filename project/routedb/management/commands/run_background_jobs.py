@@ -0,0 +1,42 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from routedb.jobs import claim_job, run_job
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (eg: route images pre-rendering)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1,
+            help="Seconds to wait before checking an empty queue again",
+        )
+
+    def stop(self, *args):
+        self.running = False
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while self.running:
+            job = claim_job()
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+            name = str(job)
+            if run_job(job):
+                self.stdout.write(f"Done: {name}")
+            else:
+                self.stdout.write(self.style.ERROR(f"Failed: {name}"))
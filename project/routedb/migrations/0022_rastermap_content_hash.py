@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0021_backgroundjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rastermap",
+            name="content_hash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                help_text="SHA-256 of the image file",
+                max_length=64,
+            ),
+        ),
+    ]
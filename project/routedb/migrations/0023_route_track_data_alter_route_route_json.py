@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0022_rastermap_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="route",
+            name="track_data",
+            field=models.BinaryField(blank=True, default=b""),
+        ),
+        migrations.AlterField(
+            model_name="route",
+            name="route_json",
+            field=models.TextField(
+                blank=True,
+                help_text="Route points as JSON, moved to track_data on save",
+            ),
+        ),
+    ]
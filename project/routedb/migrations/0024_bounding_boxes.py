@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0023_route_track_data_alter_route_route_json"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rastermap",
+            name="east",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="rastermap",
+            name="north",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="rastermap",
+            name="south",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="rastermap",
+            name="west",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="route",
+            name="east",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="route",
+            name="north",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="route",
+            name="south",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="route",
+            name="west",
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="rastermap",
+            index=models.Index(fields=["south", "north"], name="raster_map_lat_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="rastermap",
+            index=models.Index(fields=["west", "east"], name="raster_map_lon_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="route",
+            index=models.Index(fields=["south", "north"], name="route_lat_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="route",
+            index=models.Index(fields=["west", "east"], name="route_lon_idx"),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0024_bounding_boxes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rastermap",
+            name="quadkey",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                help_text="Quadkey of the tile containing the map center",
+                max_length=24,
+            ),
+        ),
+    ]
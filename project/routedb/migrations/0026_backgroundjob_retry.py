@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+def delete_duplicate_pending_jobs(apps, schema_editor):
+    """Keep the oldest of the pending jobs enqueued twice, before the unique
+    constraint forbids them"""
+    BackgroundJob = apps.get_model("routedb", "BackgroundJob")
+    seen = set()
+    duplicates = []
+    for job in BackgroundJob.objects.filter(status="pending").order_by("id"):
+        key = (job.kind, repr(sorted(job.payload.items())))
+        if key in seen:
+            duplicates.append(job.id)
+        seen.add(key)
+    BackgroundJob.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("routedb", "0025_rastermap_quadkey"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backgroundjob",
+            name="run_after",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(delete_duplicate_pending_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="backgroundjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status", "pending")),
+                fields=("kind", "payload"),
+                name="unique_pending_background_job",
+            ),
+        ),
+    ]
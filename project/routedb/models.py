@@ -4,13 +4,10 @@ import json
 import math
 import os
 import re
-import subprocess
-import tempfile
 from datetime import datetime
 from io import BytesIO
 
-import arrow
-import gpxpy
+import numpy as np
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
@@ -21,7 +18,15 @@ from django.utils.timezone import now, utc
 from django_s3_storage.storage import S3Storage
 from PIL import Image
 from tagging.registry import register as register_tagged_model
+from utils.cache import IMAGE_CACHE_TIMEOUT, single_flight
+from utils.globalmaptiles import GlobalMercator
+from utils.gpx import iter_gpx
 from utils.helper import country_at_coords, random_key, time_base64, tz_at_coords
+from utils.map_renderer import render_route_image
+from utils.render_pool import get_render_pool
+from utils.s3 import s3_delete_key, s3_key_exists, upload_to_s3
+from utils.track import Track
+from utils.track_simplify import douglas_peucker_ranks, select_points
 from utils.validators import (
     validate_corners_coordinates,
     validate_latitude,
@@ -29,6 +34,10 @@ from utils.validators import (
 )
 
 map_storage = S3Storage(aws_s3_bucket_name=settings.AWS_S3_BUCKET)
+# Zoom level of the tile quadkey stored with each map, see routedb.clusters
+MAP_QUADKEY_ZOOM = 24
+# Suffixes of the rendered route images, with header and/or route
+ROUTE_IMAGE_VARIANTS = ("_h_r", "_h", "_r", "")
 
 
 def map_upload_path(instance=None, file_name=None):
@@ -50,6 +59,34 @@ def route_upload_path(instance=None, file_name=None):
     return os.path.join(*tmp_path)
 
 
+def route_image_path(instance, arg):
+    return f"{route_upload_path(instance)}{arg}.jpg"
+
+
+def store_derivative(path, generate):
+    """Upload the image returned by `generate` to the map bucket at `path`,
+    unless it is already stored there, and return `path`"""
+    if s3_key_exists(path, settings.AWS_S3_BUCKET):
+        return path
+    data = generate()
+    if not data:
+        return None
+    upload_to_s3(settings.AWS_S3_BUCKET, path, BytesIO(data), "image/jpeg")
+    return path
+
+
+def map_clusters_cache_key(quadkey):
+    return f"map_clusters_{quadkey}"
+
+
+def invalidate_map_clusters(quadkey):
+    """Forget the map clusters of every tile containing the given one"""
+    if quadkey:
+        cache.delete_many(
+            [map_clusters_cache_key(quadkey[:zoom]) for zoom in range(len(quadkey))]
+        )
+
+
 def avatar_upload_path(instance=None, file_name=None):
     tmp_path = ["avatars"]
     time_hash = time_base64()
@@ -131,10 +168,40 @@ class RasterMap(models.Model):
     country = models.CharField(max_length=2, editable=False)
     _latitude = models.FloatField(validators=[validate_latitude], editable=False)
     _longitude = models.FloatField(validators=[validate_longitude], editable=False)
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="SHA-256 of the image file",
+    )
+    # Bounding box of the map corners, in degrees
+    north = models.FloatField(null=True, editable=False)
+    south = models.FloatField(null=True, editable=False)
+    east = models.FloatField(null=True, editable=False)
+    west = models.FloatField(null=True, editable=False)
+    quadkey = models.CharField(
+        max_length=MAP_QUADKEY_ZOOM,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="Quadkey of the tile containing the map center",
+    )
 
-    def prefetch_map_extras(self, *args, **kwargs):
+    def prefetch_map_extras(self, *args, country=None, **kwargs):
+        """Fill the fields derived from the image and its corners, `country`
+        may be looked up beforehand, eg: for many maps at once"""
         self._latitude, self._longitude = self.get_center()
-        self.country = self.get_country()
+        self.country = country or self.get_country()
+        if not self.content_hash:
+            self.content_hash = self.get_content_hash()
+
+    def get_content_hash(self):
+        hash = hashlib.sha256()
+        for chunk in self.image.chunks():
+            hash.update(chunk)
+        self.image.seek(0)
+        return hash.hexdigest()
 
     @property
     def path(self):
@@ -163,18 +230,24 @@ class RasterMap(models.Model):
             value,
         )
         if data_matched:
-            self.image.save(
-                "filename",
-                ContentFile(base64.b64decode(data_matched.group("data_b64"))),
-                save=False,
-            )
+            data = base64.b64decode(data_matched.group("data_b64"))
+            self.image.save("filename", ContentFile(data), save=False)
             self.image.close()
+            self.content_hash = hashlib.sha256(data).hexdigest()
         else:
             raise ValueError("Not a base 64 encoded data URI of an image")
 
     def strip_exif(self):
+        self.delete_thumbnails()
+        # Route images are drawn over the map image
+        for route in self.route_set.all():
+            route.delete_images()
         if self.image.closed:
             self.image.open()
+        # The hash stays the one of the file as uploaded, which new uploads
+        # are compared with to be deduplicated
+        if not self.content_hash:
+            self.content_hash = self.get_content_hash()
         with Image.open(self.image.file) as image:
             rgb_img = image.convert("RGB")
             # if image.size[0] > 2000 or image.size[1] > 2000:
@@ -192,7 +265,7 @@ class RasterMap(models.Model):
     @property
     def hash(self):
         hash = hashlib.sha256()
-        hash.update(self.data_uri.encode("utf-8"))
+        hash.update((self.content_hash or self.get_content_hash()).encode("utf-8"))
         hash.update(self.corners_coordinates.encode("utf-8"))
         return base64.b64encode(hash.digest()).decode("utf-8")
 
@@ -219,6 +292,49 @@ class RasterMap(models.Model):
             value["bottom_left"][1],
         )
 
+    def update_bbox(self):
+        corners = self.bounds.values()
+        lats = [corner[0] for corner in corners]
+        lons = [corner[1] for corner in corners]
+        self.north = max(lats)
+        self.south = min(lats)
+        self.east = max(lons)
+        self.west = min(lons)
+
+    def update_quadkey(self):
+        self.quadkey = GlobalMercator().latlon_to_quadkey(
+            {"lat": self._latitude, "lng": self._longitude}, MAP_QUADKEY_ZOOM
+        )
+
+    def stored_quadkey(self):
+        """Quadkey of the map as last saved, None if it never was"""
+        if self.pk is None:
+            return None
+        return (
+            RasterMap.objects.filter(pk=self.pk)
+            .values_list("quadkey", flat=True)
+            .first()
+        )
+
+    def save(self, *args, **kwargs):
+        self.update_bbox()
+        # The corners may have been edited, eg: in the admin
+        self._latitude, self._longitude = self.get_center()
+        self.update_quadkey()
+        previous_quadkey = self.stored_quadkey()
+        super().save(*args, **kwargs)
+        invalidate_map_clusters(self.quadkey)
+        # A moved map leaves the clusters of its former tile
+        if previous_quadkey != self.quadkey:
+            invalidate_map_clusters(previous_quadkey)
+
+    def delete(self, *args, **kwargs):
+        invalidate_map_clusters(self.quadkey)
+        previous_quadkey = self.stored_quadkey()
+        if previous_quadkey != self.quadkey:
+            invalidate_map_clusters(previous_quadkey)
+        return super().delete(*args, **kwargs)
+
     @property
     def size(self):
         return {"width": self.width, "height": self.height}
@@ -236,79 +352,92 @@ class RasterMap(models.Model):
     def get_country(self):
         return country_at_coords(*self.center)
 
-    @property
-    def thumbnail(self):
-        cache_key = f"map_{self.image.name}_thumb"
-        cached_thumb = cache.get(cache_key)
-        if cached_thumb:
-            return cached_thumb
-        orig = self.image.storage.open(self.image.name, "rb").read()
-        img = Image.open(BytesIO(orig))
-        if img.mode != "RGBA":
-            img = img.convert("RGB")
-        img = img.transform(
-            (256, 256),
-            Image.QUAD,
-            (
-                int(self.width) / 2 - 256,
-                int(self.height) / 2 - 256,
-                int(self.width) / 2 - 256,
-                int(self.height) / 2 + 256,
-                int(self.width) / 2 + 256,
-                int(self.height) / 2 + 256,
-                int(self.width) / 2 + 256,
-                int(self.height) / 2 - 256,
-            ),
+    def thumbnail_cache_key(self, name):
+        return f"map_{self.image.name}_{name}_s3"
+
+    def thumbnail_storage_path(self, name):
+        return f"{self.image.name}_{name}.jpg"
+
+    def get_thumbnail_path(self, name):
+        """Path of a thumbnail in the map bucket, generated if needed"""
+        return single_flight(
+            self.thumbnail_cache_key(name), lambda: self.store_thumbnails()[name]
         )
-        img_out = Image.new("RGB", img.size, (255, 255, 255, 0))
-        img_out.paste(img, (0, 0))
-        img.close()
-        up_buffer = BytesIO()
-        img_out.save(up_buffer, "JPEG", quality=80)
-        up_buffer.seek(0)
-        data_out = up_buffer.read()
-        try:
-            cache.set(cache_key, data_out, 31 * 24 * 3600)
-        except Exception:
-            pass
-        return data_out
 
     @property
-    def og_thumbnail(self):
-        cache_key = f"map_{self.image.name}_og_thumb"
-        cached_thumb = cache.get(cache_key)
-        if cached_thumb:
-            return cached_thumb
-        orig = self.image.storage.open(self.image.name, "rb").read()
-        img = Image.open(BytesIO(orig))
-        if img.mode != "RGBA":
-            img = img.convert("RGB")
-        img = img.transform(
-            (1200, 630),
-            Image.QUAD,
-            (
-                int(self.width) / 2 - 300,
-                int(self.height) / 2 - 158,
-                int(self.width) / 2 - 300,
-                int(self.height) / 2 + 157,
-                int(self.width) / 2 + 300,
-                int(self.height) / 2 + 157,
-                int(self.width) / 2 + 300,
-                int(self.height) / 2 - 158,
+    def thumbnail_path(self):
+        return self.get_thumbnail_path("thumb")
+
+    @property
+    def og_thumbnail_path(self):
+        return self.get_thumbnail_path("og_thumb")
+
+    def store_thumbnails(self):
+        """Generate the missing thumbnails, upload them to the map bucket and
+        return the paths of all of them"""
+        paths = {
+            name: self.thumbnail_storage_path(name)
+            for name in settings.MAP_THUMBNAIL_SIZES
+        }
+        missing = [
+            name
+            for name, path in paths.items()
+            if not s3_key_exists(path, settings.AWS_S3_BUCKET)
+        ]
+        if missing:
+            for name, data in self.generate_thumbnails(missing).items():
+                upload_to_s3(
+                    settings.AWS_S3_BUCKET, paths[name], BytesIO(data), "image/jpeg"
+                )
+        for name, path in paths.items():
+            try:
+                cache.set(self.thumbnail_cache_key(name), path, IMAGE_CACHE_TIMEOUT)
+            except Exception:
+                pass
+        return paths
+
+    def generate_thumbnails(self, names):
+        """Return the JPEG data of the given thumbnails
+
+        The map image is fetched and decoded only once, JPEG images at the
+        smallest scale that still has enough pixels for every crop.
+        """
+        sizes = {name: settings.MAP_THUMBNAIL_SIZES[name] for name in names}
+        scale = min(
+            1,
+            max(
+                max(size[0] / crop[0], size[1] / crop[1])
+                for size, crop in sizes.values()
             ),
         )
-        img_out = Image.new("RGB", img.size, (255, 255, 255, 0))
-        img_out.paste(img, (0, 0))
+        with self.image.storage.open(self.image.name, "rb") as fp:
+            img = Image.open(fp)
+            img.draft(
+                "RGB",
+                (math.ceil(self.width * scale), math.ceil(self.height * scale)),
+            )
+            img.load()
+        scale = img.width / self.width
+        thumbnails = {}
+        for name, (size, crop) in sizes.items():
+            crop_width = crop[0] * scale
+            crop_height = crop[1] * scale
+            left = round(img.width / 2 - crop_width / 2)
+            top = round(img.height / 2 - crop_height / 2)
+            region = img.crop(
+                (left, top, left + round(crop_width), top + round(crop_height))
+            )
+            out = region.convert("RGB").resize(size, Image.BILINEAR, reducing_gap=2.0)
+            up_buffer = BytesIO()
+            out.save(up_buffer, "JPEG", quality=80)
+            thumbnails[name] = up_buffer.getvalue()
         img.close()
-        up_buffer = BytesIO()
-        img_out.save(up_buffer, "JPEG", quality=80)
-        up_buffer.seek(0)
-        data_out = up_buffer.read()
-        try:
-            cache.set(cache_key, data_out, 31 * 24 * 3600)
-        except Exception:
-            pass
-        return data_out
+        return thumbnails
+
+    def delete_thumbnails(self):
+        for name in settings.MAP_THUMBNAIL_SIZES:
+            s3_delete_key(self.thumbnail_storage_path(name), settings.AWS_S3_BUCKET)
+            cache.delete(self.thumbnail_cache_key(name))
 
     @property
     def image_url(self):
@@ -325,6 +454,10 @@ class RasterMap(models.Model):
         ordering = ["-creation_date"]
         verbose_name = "raster map"
         verbose_name_plural = "raster maps"
+        indexes = [
+            models.Index(fields=["south", "north"], name="raster_map_lat_idx"),
+            models.Index(fields=["west", "east"], name="raster_map_lon_idx"),
+        ]
 
 
 class Route(models.Model):
@@ -339,7 +472,11 @@ class Route(models.Model):
     is_private = models.BooleanField(default=False)
     athlete = models.ForeignKey(User, related_name="routes", on_delete=models.CASCADE)
     name = models.CharField(max_length=52)
-    route_json = models.TextField()
+    route_json = models.TextField(
+        blank=True,
+        help_text="Route points as JSON, moved to track_data on save",
+    )
+    track_data = models.BinaryField(blank=True, default=b"", editable=False)
     raster_map = models.ForeignKey(
         RasterMap, blank=True, null=True, on_delete=models.SET_NULL
     )
@@ -349,10 +486,16 @@ class Route(models.Model):
     distance = models.IntegerField()
     duration = models.IntegerField(blank=True, null=True)
     comment = models.TextField(blank=True)
+    # Bounding box of the track, in degrees
+    north = models.FloatField(null=True, editable=False)
+    south = models.FloatField(null=True, editable=False)
+    east = models.FloatField(null=True, editable=False)
+    west = models.FloatField(null=True, editable=False)
 
     def prefetch_route_extras(self, *args, **kwargs):
-        if self.route[0]["time"]:
-            self.start_time = datetime.fromtimestamp(self.route[0]["time"], utc)
+        track = self.track
+        if track.has_time:
+            self.start_time = datetime.fromtimestamp(track.start_time, utc)
             self.duration = self.get_duration()
         elif self.start_time is None:
             self.start_time = now()
@@ -360,93 +503,155 @@ class Route(models.Model):
         self.tz = self.get_tz() or "UTC"
         self.distance = self.get_distance()
 
+    def update_bbox(self):
+        bbox = self.track.metrics.bbox if self.route_json or self.track_data else None
+        for name in ("north", "south", "east", "west"):
+            setattr(self, name, bbox[name] if bbox else None)
+
+    def save(self, *args, **kwargs):
+        if "track_data" not in self.get_deferred_fields():
+            self.update_bbox()
+        if self.route_json:
+            self.track_data = self.track.to_bytes()
+            self.route_json = ""
+        super().save(*args, **kwargs)
+        # The route may have made its map public or private
+        if self.raster_map_id:
+            invalidate_map_clusters(self.raster_map.quadkey)
+
+    def delete(self, *args, **kwargs):
+        if self.raster_map_id:
+            invalidate_map_clusters(self.raster_map.quadkey)
+        return super().delete(*args, **kwargs)
+
+    def _route_cache(self):
+        # Decoded lazily, once per stored value whoever assigns it
+        source = self.route_json or self.track_data
+        cached = getattr(self, "_route_cache_value", None)
+        if cached is None or cached["source"] is not source:
+            cached = {"source": source}
+            self._route_cache_value = cached
+        return cached
+
     @property
     def route(self):
-        return json.loads(self.route_json)
+        cached = self._route_cache()
+        if "points" not in cached:
+            if self.route_json:
+                cached["points"] = json.loads(self.route_json)
+            else:
+                cached["points"] = self.track.to_points()
+        return cached["points"]
 
     @route.setter
     def route(self, value):
-        self.route_json = json.dumps(value)
+        self.track_data = Track.from_points(value).to_bytes()
+        self.route_json = ""
 
-    def route_image(self, header=True, route=True):
+    @property
+    def track(self):
+        cached = self._route_cache()
+        if "track" not in cached:
+            if self.route_json:
+                cached["track"] = Track.from_points(self.route)
+            else:
+                cached["track"] = Track.from_bytes(self.track_data)
+        return cached["track"]
+
+    @track.setter
+    def track(self, value):
+        self.track_data = value.to_bytes()
+        self.route_json = ""
+
+    def simplification_cache_key(self):
+        version = int(self.modification_date.timestamp() * 1e6)
+        return f"route_{self.uid}_{version}_simplification"
+
+    def get_simplification(self):
+        """Douglas-Peucker ranks of the track points, see utils.track_simplify"""
+        key = self.simplification_cache_key()
+        cached = cache.get(key)
+        if cached:
+            indices, ranks = cached
+            return np.frombuffer(indices, np.int32), np.frombuffer(ranks, np.float32)
+        track = self.track
+        indices, ranks = douglas_peucker_ranks(
+            track.lats, track.lons, settings.ROUTE_SIMPLIFY_MIN_TOLERANCE
+        )
+        indices = indices.astype(np.int32)
+        ranks = ranks.astype(np.float32)
+        try:
+            cache.set(key, (indices.tobytes(), ranks.tobytes()), IMAGE_CACHE_TIMEOUT)
+        except Exception:
+            pass
+        return indices, ranks
+
+    def simplified_track(self, tolerance=None, max_points=None):
+        """The track simplified to `tolerance` meters and/or `max_points`
+
+        No tolerance or a tolerance of 0 keeps every point up to `max_points`,
+        others are at least ROUTE_SIMPLIFY_MIN_TOLERANCE.
+        """
+        track = self.track
+        if not tolerance and (max_points is None or max_points >= len(track)):
+            return track
+        indices, ranks = self.get_simplification()
+        return track.take(select_points(indices, ranks, tolerance, max_points))
+
+    def route_image_path(self, header=True, route=True):
+        """Path of the route image in the map bucket, rendered if needed"""
         arg = "_h" if header else ""
         arg += "_r" if route else ""
-        cache_key = f"route_{self.images_path}{arg}"
-        cached = cache.get(cache_key)
-        if cached:
-            return cached
-        orig = self.raster_map.data
-        data_uri = ""
-        with (
-            tempfile.NamedTemporaryFile() as img_file,
-            tempfile.NamedTemporaryFile() as route_file,
-        ):
-            img_file.write(orig)
-            img_file.flush()
-            route_file.write(self.route_json.encode("utf-8"))
-            route_file.flush()
-            data_uri = subprocess.check_output(
-                [
-                    settings.NODEJS_PATH,
-                    "generate_map.js",
-                    img_file.name,
-                    route_file.name,
-                    json.dumps(self.raster_map.bounds),
-                    arg,
-                    self.tz,
-                ],
-                stderr=subprocess.STDOUT,
-                cwd=os.path.join(settings.BASE_DIR, "jstools"),
-                env=dict(os.environ, NODE_OPTIONS="--openssl-legacy-provider"),
-            )
+        return single_flight(
+            self.image_cache_key(arg),
+            lambda: store_derivative(
+                route_image_path(self, arg), lambda: self.draw_route_image(arg)
+            ),
+        )
 
-        if data_uri:
-            header, encoded = data_uri.decode("utf-8").split(",", 1)
-            if not header.startswith("data"):
-                return None
-            data = base64.b64decode(encoded)
-            try:
-                cache.set(cache_key, data, 31 * 24 * 3600)
-            except Exception:
-                pass
-            return data
-        return None
+    def image_cache_key(self, arg):
+        return f"route_{self.images_path}{arg}_s3"
+
+    def delete_images(self):
+        for arg in ROUTE_IMAGE_VARIANTS:
+            s3_delete_key(route_image_path(self, arg), settings.AWS_S3_BUCKET)
+            cache.delete(self.image_cache_key(arg))
+
+    def draw_route_image(self, arg):
+        track = self.simplified_track(settings.ROUTE_RENDER_SIMPLIFY_TOLERANCE)
+        if settings.ROUTE_RENDER_ENGINE == "python":
+            return render_route_image(
+                self.raster_map.data,
+                self.raster_map.bounds,
+                track,
+                arg,
+                self.tz,
+            )
+        if track is self.track:
+            route_json = json.dumps(self.route)
+        else:
+            route_json = json.dumps(track.to_points())
+        return get_render_pool().render(
+            {"corners": self.raster_map.bounds, "type": arg, "tz": self.tz},
+            route_json.encode("utf-8"),
+            self.raster_map.data,
+        )
 
     @property
     def api_url(self):
         return reverse("route_detail", kwargs={"uid": self.uid})
 
     def get_tz(self):
-        return tz_at_coords(
-            self.route[0]["latlon"][0],
-            self.route[0]["latlon"][1],
-        )
+        return tz_at_coords(self.track.lats[0], self.track.lons[0])
 
     def get_country(self):
-        return country_at_coords(
-            self.route[0]["latlon"][0],
-            self.route[0]["latlon"][1],
-        )
+        return country_at_coords(self.track.lats[0], self.track.lons[0])
 
     def get_duration(self):
-        return self.route[-1]["time"] - self.route[0]["time"]
+        return self.track.metrics.duration
 
     def get_distance(self):
-        d = 0
-        prev_p = self.route[0]
-        c = math.pi / 180
-        for p in self.route[1:]:
-            dlat = p["latlon"][0] - prev_p["latlon"][0]
-            dlon = p["latlon"][1] - prev_p["latlon"][1]
-            a = (
-                math.sin(c * dlat / 2) ** 2
-                + math.cos(c * p["latlon"][0])
-                * math.cos(c * prev_p["latlon"][0])
-                * math.sin(c * dlon / 2) ** 2
-            )
-            d += 12756274 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-            prev_p = p
-        return d
+        return self.track.metrics.distance
 
     @property
     def athlete_fullname(self):
@@ -465,23 +670,7 @@ class Route(models.Model):
 
     @property
     def gpx(self):
-        gpx = gpxpy.gpx.GPX()
-        gpx.creator = "Mapdump.com"
-        gpx_track = gpxpy.gpx.GPXTrack()
-        gpx.tracks.append(gpx_track)
-
-        gpx_segment = gpxpy.gpx.GPXTrackSegment()
-        locs = self.route
-        for location in locs:
-            pt = gpxpy.gpx.GPXTrackPoint(
-                location["latlon"][0],
-                location["latlon"][1],
-            )
-            if location["time"]:
-                pt.time = arrow.get(location["time"]).datetime
-            gpx_segment.points.append(pt)
-        gpx_track.segments.append(gpx_segment)
-        return gpx.to_xml()
+        return "".join(iter_gpx(self.track))
 
     @property
     def gpx_url(self):
@@ -500,6 +689,48 @@ class Route(models.Model):
         ordering = ["-start_time"]
         verbose_name = "route"
         verbose_name_plural = "routes"
+        indexes = [
+            models.Index(fields=["south", "north"], name="route_lat_idx"),
+            models.Index(fields=["west", "east"], name="route_lon_idx"),
+        ]
 
 
 register_tagged_model(Route)
+
+
+class BackgroundJob(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (FAILED, "Failed"),
+    )
+
+    kind = models.CharField(max_length=32)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=8, choices=STATUS_CHOICES, default=PENDING, db_index=True
+    )
+    creation_date = models.DateTimeField(auto_now_add=True)
+    start_date = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # Failed jobs are retried once this date has passed
+    run_after = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "{} job <{}>".format(self.kind, self.id)
+
+    class Meta:
+        ordering = ["id"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "payload"],
+                condition=models.Q(status="pending"),
+                name="unique_pending_background_job",
+            )
+        ]
+        verbose_name = "background job"
+        verbose_name_plural = "background jobs"
@@ -3,6 +3,7 @@ import re
 from io import BytesIO
 
 from allauth.account.models import EmailAddress
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from django.db.models import Q
@@ -11,7 +12,9 @@ from django.utils.translation import gettext_lazy as _
 from PIL import Image
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from routedb.jobs import enqueue_route_render
 from routedb.models import RasterMap, Route, UserSettings
+from utils.track_import import parse_track_file
 from utils.validators import (
     custom_username_validators,
     validate_latitude,
@@ -76,6 +79,34 @@ class RelativeURLField(serializers.ReadOnlyField):
         return url
 
 
+class RouteDataField(serializers.JSONField):
+    """
+    Route points, simplified when the request has a `simplify` (tolerance in
+    meters) or a `max_points` query parameter. `simplify=0` keeps every
+    point, smaller tolerances than ROUTE_SIMPLIFY_MIN_TOLERANCE are raised
+    to it.
+    """
+
+    def get_attribute(self, instance):
+        request = self.context.get("request")
+        if request is None or request.method != "GET":
+            return super().get_attribute(instance)
+        tolerance = request.query_params.get("simplify")
+        max_points = request.query_params.get("max_points")
+        if tolerance is None and max_points is None:
+            return super().get_attribute(instance)
+        try:
+            tolerance = None if tolerance is None else float(tolerance)
+            max_points = None if max_points is None else int(max_points)
+        except ValueError:
+            raise ValidationError("Invalid simplify or max_points value")
+        if (tolerance is not None and not tolerance >= 0) or (
+            max_points is not None and max_points < 2
+        ):
+            raise ValidationError("Invalid simplify or max_points value")
+        return instance.simplified_track(tolerance, max_points).to_points()
+
+
 class UserSettingsSerializer(serializers.ModelSerializer):
     avatar_base64 = serializers.CharField(source="avatar_b64", write_only=True)
 
@@ -127,7 +158,8 @@ class RouteSerializer(serializers.ModelSerializer):
     gpx_url = RelativeURLField()
     map_url = RelativeURLField(source="image_url")
     map_thumbnail_url = RelativeURLField(source="thumbnail_url")
-    route_data = serializers.JSONField(source="route")
+    route_data = RouteDataField(source="route", required=False)
+    route_file = serializers.FileField(write_only=True, required=False)
     map_bounds = serializers.JSONField(source="raster_map.bounds", required=False)
     id = serializers.ReadOnlyField(source="uid")
     athlete = UserInfoSerializer(read_only=True)
@@ -158,6 +190,12 @@ class RouteSerializer(serializers.ModelSerializer):
             validate_longitude(value[x][1])
         return value
 
+    def validate_route_file(self, value):
+        try:
+            return parse_track_file(value, settings.ROUTE_IMPORT_MAX_POINTS)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
     def validate_route_data(self, value):
         if not isinstance(value, list) or len(value) <= 0:
             raise ValidationError("Invalid route data")
@@ -179,7 +217,11 @@ class RouteSerializer(serializers.ModelSerializer):
         if request and request.method in ("PUT", "PATCH"):
             if data.get("raster_map"):
                 raise ValidationError("This method does not allow to update to map")
+            if data.get("route") and data.get("route_file"):
+                raise ValidationError("Either set route_data or route_file, not both")
         else:  # Method is POST
+            if bool(data.get("route")) == bool(data.get("route_file")):
+                raise ValidationError("Either set route_data or route_file")
             if data.get("start_time"):
                 if data.get("route_data", {}).get("time", [None])[0]:
                     raise ValidationError("Route data already include time")
@@ -220,7 +262,17 @@ class RouteSerializer(serializers.ModelSerializer):
             )
             raster_map.bounds = validated_data["raster_map"]["bounds"]
             raster_map.prefetch_map_extras()
-            raster_map.save()
+            # Reuse the same map uploaded earlier by the same user, other
+            # users maps are deleted along with their account.
+            existing_map = RasterMap.objects.filter(
+                uploader=user,
+                content_hash=raster_map.content_hash,
+                corners_coordinates=raster_map.corners_coordinates,
+            ).first()
+            if existing_map:
+                raster_map = existing_map
+            else:
+                raster_map.save()
         route = Route(
             athlete=user,
             raster_map=raster_map,
@@ -231,11 +283,19 @@ class RouteSerializer(serializers.ModelSerializer):
             route.start_time = validated_data["start_time"]
         if validated_data.get("is_private"):
             route.is_private = True
-        route.route = validated_data["route"]
+        if validated_data.get("route_file"):
+            route.track = validated_data["route_file"]
+        else:
+            route.route = validated_data["route"]
         route.prefetch_route_extras()
         route.save()
         return route
 
+    def update(self, instance, validated_data):
+        if validated_data.get("route_file"):
+            instance.track = validated_data.pop("route_file")
+        return super().update(instance, validated_data)
+
     def save(self):
         super().save()
         instance = self.instance
@@ -246,6 +306,7 @@ class RouteSerializer(serializers.ModelSerializer):
             hashtag_match.group(2).lower()
             for hashtag_match in re.finditer(HASHTAG_REGEX, comment)
         )
+        enqueue_route_render(instance)
 
     class Meta:
         model = Route
@@ -268,6 +329,7 @@ class RouteSerializer(serializers.ModelSerializer):
             "map_size",
             "comment",
             "route_data",
+            "route_file",
             "is_private",
         )
 
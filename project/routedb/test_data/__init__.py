@@ -0,0 +1,31 @@
+"""Files used by the tests
+
+render/ holds a small map and route, and the images of that route drawn
+by the node renderer, written by the `render_reference` command.
+"""
+
+import json
+import os
+
+from utils.track import Track
+
+RENDER_DIR = os.path.join(os.path.dirname(__file__), "render")
+REFERENCE_VARIANTS = ("_h_r", "_r")
+
+
+def render_fixture():
+    """Map image, map corners, track and timezone of the render fixture"""
+    with open(os.path.join(RENDER_DIR, "map.jpg"), "rb") as fp:
+        map_data = fp.read()
+    with open(os.path.join(RENDER_DIR, "route.json")) as fp:
+        fixture = json.load(fp)
+    return (
+        map_data,
+        fixture["corners"],
+        Track.from_points(fixture["route"]),
+        fixture["tz"],
+    )
+
+
+def reference_path(variant):
+    return os.path.join(RENDER_DIR, f"reference{variant}.jpg")
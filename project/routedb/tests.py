@@ -0,0 +1,235 @@
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils.timezone import now
+from PIL import Image
+from rest_framework.test import APIClient
+from routedb.jobs import EXPORT_ACCOUNT, claim_job
+from routedb.models import BackgroundJob, RasterMap, Route, map_clusters_cache_key
+from routedb.test_data import REFERENCE_VARIANTS, reference_path, render_fixture
+from utils.map_renderer import (
+    MAX_MEAN_DIFF,
+    MAX_PIXELS_OFF,
+    image_difference,
+    render_route_image,
+)
+from utils.render_pool import RenderPool, RenderTimeout
+from utils.track_import import parse_track_file
+
+GPX_LAST_POINT_UNTIMED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1">
+  <trk><trkseg>
+    <trkpt lat="60.1" lon="24.9"><time>2022-04-15T05:20:00Z</time></trkpt>
+    <trkpt lat="60.1001" lon="24.9002"><time>2022-04-15T05:20:10Z</time></trkpt>
+    <trkpt lat="60.1002" lon="24.9004"></trkpt>
+  </trkseg></trk>
+</gpx>"""
+
+
+class RouteImportTestCase(TestCase):
+    client_class = APIClient
+
+    def test_duration_ignores_untimed_points(self):
+        track = parse_track_file(BytesIO(GPX_LAST_POINT_UNTIMED), 100)
+        self.assertEqual(track.metrics.duration, 10)
+        user = User.objects.create_user("alice")
+        route = Route(athlete=user, name="Morning run")
+        route.track = track
+        route.prefetch_route_extras()
+        route.save()
+        route.refresh_from_db()
+        self.assertEqual(route.duration, 10)
+
+    def test_update_rejects_route_data_with_route_file(self):
+        user = User.objects.create_user("alice")
+        route = Route(athlete=user, name="Morning run")
+        route.track = parse_track_file(BytesIO(GPX_LAST_POINT_UNTIMED), 100)
+        route.prefetch_route_extras()
+        route.save()
+        self.client.force_login(user)
+        with mock.patch("routedb.models.s3_delete_key"):
+            response = self.client.patch(
+                reverse("route_detail", kwargs={"uid": route.uid}),
+                {
+                    "route_data": json.dumps([{"time": None, "latlon": [1, 2]}]),
+                    "route_file": SimpleUploadedFile("run.gpx", GPX_LAST_POINT_UNTIMED),
+                },
+                format="multipart",
+                HTTP_HOST="localhost",
+            )
+        self.assertEqual(response.status_code, 400)
+        route.refresh_from_db()
+        self.assertEqual(len(route.track), 3)
+
+    def test_simplify_zero_keeps_every_point(self):
+        user = User.objects.create_user("alice")
+        raster_map = RasterMap.objects.create(
+            uploader=user,
+            image="maps/a/b/x",
+            width=100,
+            height=100,
+            corners_coordinates="60.2,24.9,60.2,25.0,60.1,25.0,60.1,24.9",
+            country="FI",
+            content_hash="x",
+        )
+        # Points along a line, all but its ends within the tolerance
+        points = [
+            {"time": 1650000000 + i, "latlon": [60.1 + i * 1e-5, 24.9]}
+            for i in range(50)
+        ]
+        route = Route(athlete=user, name="Morning run", raster_map=raster_map)
+        route.route = points
+        route.prefetch_route_extras()
+        route.save()
+        url = reverse("route_detail", kwargs={"uid": route.uid})
+        response = self.client.get(url, {"simplify": 0}, HTTP_HOST="localhost")
+        self.assertEqual(len(response.data["route_data"]), 50)
+        response = self.client.get(url, {"simplify": 1}, HTTP_HOST="localhost")
+        self.assertEqual(len(response.data["route_data"]), 2)
+
+
+class AccountExportTestCase(TestCase):
+    client_class = APIClient
+
+    def test_archive_status_ignores_failed_jobs(self):
+        user = User.objects.create_user("alice")
+        BackgroundJob.objects.create(
+            kind=EXPORT_ACCOUNT,
+            payload={"user_id": user.id},
+            status=BackgroundJob.FAILED,
+        )
+        self.client.force_login(user)
+        url = reverse("account_export_archive")
+        with mock.patch("routedb.views.s3_key_exists", return_value=False):
+            response = self.client.get(url, HTTP_HOST="localhost")
+        self.assertEqual(response.data["status"], BackgroundJob.FAILED)
+        with mock.patch("routedb.views.s3_key_exists", return_value=True):
+            response = self.client.get(url, HTTP_HOST="localhost")
+        self.assertEqual(response.data["status"], "ready")
+        response = self.client.post(url, HTTP_HOST="localhost")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            list(BackgroundJob.objects.values_list("status", flat=True)),
+            [BackgroundJob.PENDING],
+        )
+
+
+class BackgroundJobTestCase(TestCase):
+    def test_stale_job_given_up_after_max_attempts(self):
+        job = BackgroundJob.objects.create(
+            kind=EXPORT_ACCOUNT,
+            payload={"user_id": 1},
+            status=BackgroundJob.RUNNING,
+            start_date=now() - timedelta(seconds=settings.BACKGROUND_JOB_TIMEOUT + 1),
+            attempts=settings.BACKGROUND_JOB_MAX_ATTEMPTS - 1,
+        )
+        self.assertEqual(claim_job(), job)
+        BackgroundJob.objects.filter(id=job.id).update(
+            start_date=now() - timedelta(seconds=settings.BACKGROUND_JOB_TIMEOUT + 1)
+        )
+        self.assertIsNone(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.FAILED)
+
+
+class RasterMapTestCase(TestCase):
+    def test_strip_exif_keeps_upload_hash(self):
+        buffer = BytesIO()
+        Image.new("RGB", (64, 48), (200, 120, 40)).save(
+            buffer, "JPEG", exif=b"Exif\x00\x00MM\x00*\x00\x00\x00\x08\x00\x00"
+        )
+        data = buffer.getvalue()
+        user = User.objects.create_user("alice")
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            mock.patch.object(
+                RasterMap._meta.get_field("image"),
+                "storage",
+                FileSystemStorage(tmp_dir),
+            ),
+            mock.patch("routedb.models.s3_delete_key"),
+        ):
+            raster_map = RasterMap(
+                uploader=user,
+                corners_coordinates="60.2,24.9,60.2,25.0,60.1,25.0,60.1,24.9",
+                country="FI",
+            )
+            raster_map.image.save("map.jpg", ContentFile(data))
+            raster_map.strip_exif()
+            self.assertNotEqual(raster_map.data, data)
+        upload = RasterMap(image=SimpleUploadedFile("map.jpg", data))
+        self.assertEqual(raster_map.content_hash, upload.get_content_hash())
+
+
+class MapClustersTestCase(TestCase):
+    def test_moved_map_leaves_former_tile_clusters(self):
+        user = User.objects.create_user("alice")
+        raster_map = RasterMap.objects.create(
+            uploader=user,
+            image="maps/a/b/x",
+            width=100,
+            height=100,
+            corners_coordinates="60.2,24.9,60.2,25.0,60.1,25.0,60.1,24.9",
+            country="FI",
+            content_hash="x",
+        )
+        tile_key = map_clusters_cache_key(raster_map.quadkey[:5])
+        cache.set(tile_key, [])
+        raster_map.corners_coordinates = "48.9,2.3,48.9,2.4,48.8,2.4,48.8,2.3"
+        raster_map.save()
+        self.assertIsNone(cache.get(tile_key))
+        self.assertFalse(raster_map.quadkey.startswith(tile_key[-5:]))
+        tile_key = map_clusters_cache_key(raster_map.quadkey[:5])
+        cache.set(tile_key, [])
+        raster_map.delete()
+        self.assertIsNone(cache.get(tile_key))
+
+
+class RouteImageTestCase(SimpleTestCase):
+    def test_python_engine_matches_node_reference(self):
+        map_data, corners, track, tz = render_fixture()
+        for variant in REFERENCE_VARIANTS:
+            with self.subTest(variant=variant):
+                path = reference_path(variant)
+                if not os.path.exists(path):
+                    self.skipTest(
+                        f"No node reference image {path}, "
+                        "write it with the render_reference command"
+                    )
+                with open(path, "rb") as fp:
+                    reference = fp.read()
+                image = render_route_image(map_data, corners, track, variant, tz)
+                mean_diff, pixels_off = image_difference(reference, image)
+                self.assertLessEqual(mean_diff, MAX_MEAN_DIFF)
+                self.assertLessEqual(pixels_off, MAX_PIXELS_OFF)
+
+
+class RenderPoolTestCase(SimpleTestCase):
+    def test_write_to_wedged_worker_times_out(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # A worker which never reads its jobs
+            node_path = os.path.join(tmp_dir, "node")
+            with open(node_path, "w") as fp:
+                fp.write("#!/bin/sh\nexec sleep 60\n")
+            os.chmod(node_path, 0o755)
+            pool = RenderPool(size=1, max_jobs=10, max_rss=2**30, timeout=0.5)
+            with self.settings(NODEJS_PATH=node_path):
+                t0 = time.monotonic()
+                with self.assertRaises(RenderTimeout):
+                    pool.render({}, b"[]", b"\0" * 2**20)
+            self.assertLess(time.monotonic() - t0, 5)
+            self.assertEqual(pool.stats["timeouts"], 1)
+            pool.close()
@@ -12,6 +12,7 @@ urlpatterns = [
     ),
     path("latest-routes/feed/", feeds.latest_routes_feed, name="latest_routes_feed"),
     path("maps/", views.MapsList.as_view(), name="maps_list"),
+    path("maps/clusters", views.map_clusters, name="map_clusters"),
     re_path(
         r"^user/(?P<username>[a-zA-Z0-9_-]+)/?$",
         views.UserDetail.as_view(),
@@ -50,6 +51,22 @@ urlpatterns = [
         views.raster_map_download,
         name="raster_map_image",
     ),
+    path("export/", views.account_export, name="account_export"),
+    path(
+        "export/archive",
+        views.account_export_archive,
+        name="account_export_archive",
+    ),
+    path(
+        "export/archive/download",
+        views.account_export_archive_download,
+        name="account_export_archive_download",
+    ),
+    path(
+        "render-pool/status",
+        views.render_pool_status,
+        name="render_pool_status",
+    ),
     path("auth/user/", view=views.UserEditView.as_view(), name="auth_user_detail"),
     path(
         "auth/user/settings/",
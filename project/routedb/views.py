@@ -1,4 +1,6 @@
+import hashlib
 import json
+import math
 import os.path
 import re
 import time
@@ -14,17 +16,28 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_logged_in
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.cache import cache
 from django.db.models import Q
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from knox.models import AuthToken
 from rest_framework import generics, parsers, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import SAFE_METHODS, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from routedb.models import RasterMap, Route, UserSettings
+from routedb.clusters import get_map_clusters, max_cluster_zoom, tiles_in_bbox
+from routedb.export import export_path, iter_export
+from routedb.jobs import EXPORT_ACCOUNT, enqueue
+from routedb.models import BackgroundJob, RasterMap, Route, UserSettings
 from routedb.serializers import (
     AuthTokenSerializer,
     EmailSerializer,
@@ -39,7 +52,10 @@ from routedb.serializers import (
 from stravalib import Client as StravaClient
 from tagging.models import TaggedItem
 from tagging.utils import get_tag
-from utils.s3 import s3_object_url
+from utils.gpx import iter_gpx
+from utils.render_pool import render_pool_stats
+from utils.s3 import s3_key_exists, s3_object_url
+from utils.track_metrics import EARTH_DIAMETER
 
 
 def encode_filename(filename):
@@ -95,6 +111,42 @@ def serve_from_s3(
     return response
 
 
+def make_etag(*parts):
+    key = ":".join(str(part) for part in parts)
+    return quote_etag(hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+def route_last_modified(route):
+    dates = [route.modification_date]
+    if route.raster_map:
+        dates.append(route.raster_map.modification_date)
+    return max(dates)
+
+
+def conditional_response(request, etag, last_modified, public, get_response):
+    """Answer 304 if the client copy is still valid, otherwise call
+    `get_response`, in both cases with validators and cache headers
+    """
+    last_modified = int(last_modified.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = get_response()
+    if response.status_code >= 400 and response.status_code != 412:
+        return response
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if response.has_header("X-Accel-Redirect"):
+        # nginx drops the validators on internal redirects, the /s3/
+        # location adds them back from these headers
+        response["X-Accel-ETag"] = response["ETag"]
+        response["X-Accel-Last-Modified"] = response["Last-Modified"]
+    if public:
+        patch_cache_control(response, public=True, max_age=settings.HTTP_CACHE_MAX_AGE)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 class LoginView(generics.CreateAPIView):
     """
     Login View: mix of knox login view and drf obtain auth token view
@@ -185,15 +237,81 @@ class ListRoutesPagination(CursorPagination):
     ordering = "-start_time"
 
 
+def parse_floats(params, name, count):
+    try:
+        values = [float(v) for v in params[name].split(",")]
+    except ValueError:
+        values = []
+    if len(values) != count or not all(math.isfinite(v) for v in values):
+        raise ValidationError({name: f"Expecting {count} comma separated numbers"})
+    return values
+
+
+def parse_bbox(params):
+    south, west, north, east = parse_floats(params, "bbox", 4)
+    if not -90 <= south <= north <= 90:
+        raise ValidationError({"bbox": "Invalid latitudes"})
+    if not (-180 <= west <= 180 and -180 <= east <= 180):
+        raise ValidationError({"bbox": "Invalid longitudes"})
+    return south, west, north, east
+
+
+def bbox_filter(south, west, north, east):
+    """Items whose bounding box intersects the given one, which crosses the
+    antimeridian if west > east"""
+    q = Q(south__lte=north, north__gte=south)
+    if west <= east:
+        return q & Q(west__lte=east, east__gte=west)
+    return q & (Q(west__lte=east) | Q(east__gte=west))
+
+
+def area_filter(params):
+    """Filter of the `bbox=south,west,north,east` or the
+    `near=lat,lon&radius=meters` query parameters, None if neither is given
+
+    `near` selects the items intersecting the bounding box of the circle.
+    """
+    if "bbox" in params:
+        return bbox_filter(*parse_bbox(params))
+    if "near" in params:
+        lat, lon = parse_floats(params, "near", 2)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValidationError({"near": "Invalid coordinates"})
+        if "radius" not in params:
+            raise ValidationError({"radius": "This parameter is required with near"})
+        (radius,) = parse_floats(params, "radius", 1)
+        if radius < 0:
+            raise ValidationError({"radius": "Expecting a distance in meters"})
+        dlat = math.degrees(radius / (EARTH_DIAMETER / 2))
+        south = max(lat - dlat, -90)
+        north = min(lat + dlat, 90)
+        cos_lat = math.cos(math.radians(lat))
+        if south == -90 or north == 90 or dlat >= 180 * cos_lat:
+            return bbox_filter(south, -180, north, 180)
+        dlon = dlat / cos_lat
+        west = (lon - dlon + 180) % 360 - 180
+        east = (lon + dlon + 180) % 360 - 180
+        return bbox_filter(south, west, north, east)
+    return None
+
+
 class LatestRoutesList(generics.ListAPIView):
     serializer_class = LatestRouteListSerializer
     pagination_class = ListRoutesPagination
 
     def get_queryset(self):
-        return Route.objects.filter(
-            Q(athlete_id=self.request.user.id)
-            | Q(is_private=False)  # mine or public ones
-        ).select_related("athlete")
+        qs = (
+            Route.objects.filter(
+                Q(athlete_id=self.request.user.id)
+                | Q(is_private=False)  # mine or public ones
+            )
+            .select_related("athlete")
+            .defer("route_json", "track_data")
+        )
+        area = area_filter(self.request.query_params)
+        if area is not None:
+            qs = qs.filter(area)
+        return qs
 
 
 class RoutesForTagList(generics.ListAPIView):
@@ -201,9 +319,13 @@ class RoutesForTagList(generics.ListAPIView):
     pagination_class = ListRoutesPagination
 
     def get_queryset(self):
-        qs = Route.objects.filter(
-            Q(athlete_id=self.request.user.id) | Q(is_private=False)
-        ).select_related("athlete")
+        qs = (
+            Route.objects.filter(
+                Q(athlete_id=self.request.user.id) | Q(is_private=False)
+            )
+            .select_related("athlete")
+            .defer("route_json", "track_data")
+        )
         tag = self.kwargs["tag"].lower()
         tag_instance = get_tag(tag)
         if tag_instance is None:
@@ -216,10 +338,35 @@ class MapsList(generics.ListAPIView):
 
     def get_queryset(self):
         public_routes = Route.objects.filter(is_private=False)
-        maps_id = set(public_routes.values_list("raster_map_id", flat=True))
-        return RasterMap.objects.filter(pk__in=maps_id).prefetch_related(
-            "route_set", "route_set__athlete"
+        qs = RasterMap.objects.filter(
+            pk__in=public_routes.values("raster_map_id")
+        ).prefetch_related("route_set", "route_set__athlete")
+        area = area_filter(self.request.query_params)
+        if area is not None:
+            qs = qs.filter(area)
+        return qs
+
+
+@api_view(["GET"])
+def map_clusters(request):
+    """Clusters of the public maps at a `zoom` level, in the `bbox` area or
+    the whole world, see routedb.clusters"""
+    params = request.query_params
+    try:
+        zoom = int(params.get("zoom", ""))
+    except ValueError:
+        zoom = -1
+    if not 0 <= zoom <= max_cluster_zoom():
+        raise ValidationError(
+            {"zoom": f"Expecting a zoom level between 0 and {max_cluster_zoom()}"}
         )
+    bbox = parse_bbox(params) if "bbox" in params else (-90, -180, 90, 180)
+    try:
+        quadkeys = tiles_in_bbox(*bbox, zoom, settings.MAP_CLUSTERS_MAX_TILES)
+    except ValueError as e:
+        raise ValidationError({"bbox": str(e)})
+    clusters = get_map_clusters(quadkeys)
+    return Response([cluster for quadkey in quadkeys for cluster in clusters[quadkey]])
 
 
 class UserDetail(generics.RetrieveAPIView):
@@ -303,18 +450,34 @@ class RouteDetail(generics.RetrieveUpdateDestroyAPIView):
             .filter(Q(athlete_id=self.request.user.id) | Q(is_private=False))
         )
 
+    def retrieve(self, request, *args, **kwargs):
+        obj = self.get_object()
+        athlete = obj.athlete
+        return conditional_response(
+            request,
+            make_etag(
+                obj.uid,
+                route_last_modified(obj).isoformat(),
+                athlete.username,
+                athlete.first_name,
+                athlete.last_name,
+            ),
+            route_last_modified(obj),
+            False,
+            lambda: super(RouteDetail, self).retrieve(request, *args, **kwargs),
+        )
+
     def update(self, request, *args, **kwargs):
         obj = self.get_object()
-        cache.delete(f"route_{obj.images_path}_h")
-        cache.delete(f"route_{obj.images_path}_r")
-        cache.delete(f"route_{obj.images_path}_h_r")
-        cache.delete(f"route_{obj.images_path}")
+        obj.delete_images()
         return super().update(request, *args, **kwargs)
 
     def destroy(self, request, *args, **kwargs):
         obj = self.get_object()
+        obj.delete_images()
         rmap = obj.raster_map
         if rmap.route_set.exclude(id=obj.id).count() == 0:
+            rmap.delete_thumbnails()
             rmap.delete()
         return super().destroy(request, *args, **kwargs)
 
@@ -322,17 +485,24 @@ class RouteDetail(generics.RetrieveUpdateDestroyAPIView):
 @api_view(["GET"])
 def raster_map_download(request, uid, *args, **kwargs):
     rmap = get_object_or_404(
-        RasterMap.objects.filter(Q(athlete_id=request.user.id) | Q(is_private=False)),
+        RasterMap.objects.filter(
+            Q(uploader_id=request.user.id) | Q(route__is_private=False)
+        ).distinct(),
         uid=uid,
     )
-    file_path = rmap.path
     mime_type = rmap.mime_type
-    return serve_from_s3(
-        settings.AWS_S3_BUCKET,
+    return conditional_response(
         request,
-        "/internal/" + file_path,
-        filename="{}.{}".format(rmap.uid, mime_type[6:]),
-        mime=mime_type,
+        make_etag(rmap.uid, rmap.modification_date.isoformat()),
+        rmap.modification_date,
+        rmap.uploader_id != request.user.id,
+        lambda: serve_from_s3(
+            settings.AWS_S3_BUCKET,
+            request,
+            "/internal/" + rmap.path,
+            filename="{}.{}".format(rmap.uid, mime_type[6:]),
+            mime=mime_type,
+        ),
     )
 
 
@@ -347,32 +517,40 @@ def map_download(request, uid, *args, **kwargs):
         ).select_related("raster_map"),
         uid=uid,
     )
+    if not route.raster_map:
+        raise Http404()
     basename = f"{route.name}."
-    mime_type = "image/jpeg"
-    if show_header or show_route:
-        img = route.route_image(show_header, show_route)
-        filename = f"{basename}{mime_type[6:]}"
-        r = HttpResponse(img, content_type=mime_type)
-        r["Content-Disposition"] = (
-            f"attachment; filename*=UTF-8''{encode_filename(filename)}"
-        )
-        return r
-    elif out_bounds:
-        img = route.route_image(False, False)
-        filename = f"{basename}{mime_type[6:]}"
-        r = HttpResponse(img, content_type=mime_type)
-        r["Content-Disposition"] = (
-            f"attachment; filename*=UTF-8''{encode_filename(filename)}"
+    rendered = bool(show_header or show_route or out_bounds)
+
+    def get_response():
+        if rendered:
+            file_path = route.route_image_path(show_header, show_route)
+            mime_type = "image/jpeg"
+        else:
+            file_path = route.raster_map.path
+            mime_type = route.raster_map.mime_type
+        if not file_path:
+            raise Http404()
+        return serve_from_s3(
+            settings.AWS_S3_BUCKET,
+            request,
+            "/internal/" + file_path,
+            filename="{}{}".format(basename, mime_type[6:]),
+            mime=mime_type,
         )
-        return r
-    file_path = route.raster_map.path
-    mime_type = route.raster_map.mime_type
-    return serve_from_s3(
-        settings.AWS_S3_BUCKET,
+
+    variant = (bool(show_header), bool(show_route)) if rendered else "raw"
+    return conditional_response(
         request,
-        "/internal/" + file_path,
-        filename="{}{}".format(basename, mime_type[6:]),
-        mime=mime_type,
+        make_etag(
+            route.uid,
+            route_last_modified(route).isoformat(),
+            route.name,
+            variant,
+        ),
+        route_last_modified(route),
+        not route.is_private,
+        get_response,
     )
 
 
@@ -384,8 +562,25 @@ def map_thumbnail(request, uid, *args, **kwargs):
         ).select_related("raster_map"),
         uid=uid,
     )
-    image = route.raster_map.thumbnail
-    return HttpResponse(image, content_type="image/jpeg")
+    rmap = route.raster_map
+    if not rmap:
+        raise Http404()
+
+    def get_response():
+        file_path = rmap.get_thumbnail_path("thumb")
+        if not file_path:
+            raise Http404()
+        return serve_from_s3(
+            settings.AWS_S3_BUCKET, request, "/internal/" + file_path, mime="image/jpeg"
+        )
+
+    return conditional_response(
+        request,
+        make_etag(rmap.uid, rmap.modification_date.isoformat(), "thumb"),
+        rmap.modification_date,
+        not route.is_private,
+        get_response,
+    )
 
 
 @api_view(["GET"])
@@ -396,8 +591,25 @@ def map_og_thumbnail(request, uid, *args, **kwargs):
         ).select_related("raster_map"),
         uid=uid,
     )
-    image = route.raster_map.og_thumbnail
-    return HttpResponse(image, content_type="image/jpeg")
+    rmap = route.raster_map
+    if not rmap:
+        raise Http404()
+
+    def get_response():
+        file_path = rmap.get_thumbnail_path("og_thumb")
+        if not file_path:
+            raise Http404()
+        return serve_from_s3(
+            settings.AWS_S3_BUCKET, request, "/internal/" + file_path, mime="image/jpeg"
+        )
+
+    return conditional_response(
+        request,
+        make_etag(rmap.uid, rmap.modification_date.isoformat(), "og_thumb"),
+        rmap.modification_date,
+        not route.is_private,
+        get_response,
+    )
 
 
 @api_view(["GET"])
@@ -406,15 +618,104 @@ def gpx_download(request, uid, *args, **kwargs):
         Route.objects.filter(Q(athlete_id=request.user.id) | Q(is_private=False)),
         uid=uid,
     )
-    gpx_data = route.gpx
-    response = HttpResponse(gpx_data, content_type="application/gpx+xml")
-    filename = f"{route.name}.gpx"
+
+    def get_response():
+        response = StreamingHttpResponse(
+            iter_gpx(route.track), content_type="application/gpx+xml"
+        )
+        filename = f"{route.name}.gpx"
+        response["Content-Disposition"] = (
+            f"attachment; filename*=UTF-8''{encode_filename(filename)}"
+        )
+        return response
+
+    return conditional_response(
+        request,
+        make_etag(route.uid, route.modification_date.isoformat(), "gpx"),
+        route.modification_date,
+        not route.is_private,
+        get_response,
+    )
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def account_export(request):
+    routes = Route.objects.filter(athlete=request.user)
+    if (
+        routes.count() > settings.EXPORT_SYNC_MAX_ROUTES
+        or routes.exclude(raster_map=None).values("raster_map").distinct().count()
+        > settings.EXPORT_SYNC_MAX_MAPS
+    ):
+        return Response(
+            {
+                "detail": "Account too large to export at once, "
+                "request an export archive instead",
+                "archive": request.build_absolute_uri(
+                    reverse("account_export_archive")
+                ),
+            },
+            status=status.HTTP_409_CONFLICT,
+        )
+    response = StreamingHttpResponse(
+        iter_export(request.user), content_type="application/zip"
+    )
+    filename = f"mapdump-{request.user.username}.zip"
     response["Content-Disposition"] = (
         f"attachment; filename*=UTF-8''{encode_filename(filename)}"
     )
     return response
 
 
+@api_view(["GET", "POST"])
+@permission_classes([IsAuthenticated])
+def account_export_archive(request):
+    """Build the export archive in the background (POST) and report whether
+    it is ready (GET)"""
+    user = request.user
+    jobs = BackgroundJob.objects.filter(
+        kind=EXPORT_ACCOUNT, payload={"user_id": user.id}
+    ).order_by("-id")
+    if request.method == "POST":
+        # A new export supersedes the failed ones
+        jobs.filter(status=BackgroundJob.FAILED).delete()
+        enqueue(EXPORT_ACCOUNT, user_id=user.id)
+        return Response({"status": "pending"}, status=status.HTTP_202_ACCEPTED)
+    job = jobs.exclude(status=BackgroundJob.FAILED).first()
+    if job:
+        return Response({"status": job.status})
+    if s3_key_exists(export_path(user), settings.AWS_S3_BUCKET):
+        return Response(
+            {
+                "status": "ready",
+                "url": request.build_absolute_uri(
+                    reverse("account_export_archive_download")
+                ),
+            }
+        )
+    if jobs.exists():
+        return Response({"status": BackgroundJob.FAILED})
+    return Response({"status": None})
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def account_export_archive_download(request):
+    return serve_from_s3(
+        settings.AWS_S3_BUCKET,
+        request,
+        "/internal/" + export_path(request.user),
+        filename=f"mapdump-{request.user.username}.zip",
+        mime="application/zip",
+    )
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def render_pool_status(request):
+    return Response(render_pool_stats())
+
+
 @api_view(["GET"])
 @login_required
 def strava_authorize(request):
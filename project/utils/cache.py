@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+IMAGE_CACHE_TIMEOUT = 31 * 24 * 3600
+
+
+def single_flight(cache_key, compute, timeout=IMAGE_CACHE_TIMEOUT):
+    """Return the value cached at `cache_key`, computing and caching it if
+    missing.
+
+    Concurrent callers, from any process sharing the cache, do not compute
+    the same value twice: the first one takes a lock stored in the cache
+    while the others wait for its result, up to CACHE_LOCK_WAIT_TIMEOUT
+    seconds after which they compute the value themselves.
+    """
+    lock_key = f"{cache_key}_lock"
+    deadline = time.monotonic() + settings.CACHE_LOCK_WAIT_TIMEOUT
+    while True:
+        cached = cache.get(cache_key)
+        if cached:
+            return cached
+        if cache.add(lock_key, True, settings.CACHE_LOCK_TIMEOUT):
+            try:
+                return compute_and_cache(cache_key, compute, timeout)
+            finally:
+                cache.delete(lock_key)
+        if time.monotonic() >= deadline:
+            return compute_and_cache(cache_key, compute, timeout)
+        time.sleep(0.1)
+
+
+def compute_and_cache(cache_key, compute, timeout=IMAGE_CACHE_TIMEOUT):
+    data = compute()
+    if data:
+        try:
+            cache.set(cache_key, data, timeout)
+        except Exception:
+            pass
+    return data
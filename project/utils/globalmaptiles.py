@@ -1,5 +1,8 @@
 import math
 
+# Latitude of the top edge of the Spherical Mercator square
+MAX_LATITUDE = 85.0511287798066
+
 
 class GlobalMercator(object):
     def __init__(self):
@@ -37,3 +40,30 @@ class GlobalMercator(object):
             * (2 * math.atan(math.exp(lat * math.pi / 180.0)) - math.pi / 2.0)
         )
         return {"lat": lat, "lng": lon}
+
+    def latlon_to_tile(self, latlon, zoom):
+        """
+        Converts given lat/lon to the x, y of the Google tile containing it
+        at the zoom level, y going from north to south
+        """
+        lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, latlon["lat"]))
+        mxy = self.latlon_to_meters({"lat": lat, "lng": latlon["lng"]})
+        n = 2**zoom
+        x = int((mxy["x"] + self.originShift) / (2 * self.originShift) * n)
+        y = int((self.originShift - mxy["y"]) / (2 * self.originShift) * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    def tile_to_quadkey(self, x, y, zoom):
+        """
+        Converts the x, y of a Google tile to its quadkey, one digit per
+        zoom level, so that the quadkeys of the tiles it contains start
+        with its own
+        """
+        digits = []
+        for i in range(zoom, 0, -1):
+            mask = 1 << (i - 1)
+            digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+        return "".join(digits)
+
+    def latlon_to_quadkey(self, latlon, zoom):
+        return self.tile_to_quadkey(*self.latlon_to_tile(latlon, zoom), zoom)
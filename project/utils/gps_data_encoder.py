@@ -2,13 +2,20 @@ from __future__ import unicode_literals
 
 import calendar
 import re
-from bisect import bisect_left, bisect_right
 from datetime import datetime
 from decimal import Decimal
 
+import numpy as np
 from django.utils.timezone import utc
 
 YEAR2010 = 1262304000
+# Each number is written in groups of 5 bits, least significant first, as
+# characters offset by 63, 0x20 flagging that more groups follow.
+CHAR_OFFSET = 63
+GROUP_BITS = 5
+GROUP_MASK = 0x1F
+CONTINUATION = 0x20
+COORDINATES_SCALE = 1e5
 
 
 def encode_unsigned_number(num):
@@ -49,12 +56,121 @@ def decode_signed_number(encoded):
         return result >> 1, encoded_out
 
 
+def encode_numbers(values):
+    """Encode an array of unsigned integers, all at once"""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return ""
+    # Number of 5 bits groups of each value, at least one
+    groups = np.ones(len(values), dtype=np.int64)
+    for i in range(1, 13):
+        groups += values >= np.uint64(1 << (GROUP_BITS * i))
+    positions = np.arange(groups.max())
+    shifts = (positions * GROUP_BITS).astype(np.uint64)
+    chars = (values[:, None] >> shifts[None, :]) & np.uint64(GROUP_MASK)
+    more = positions[None, :] < groups[:, None] - 1
+    chars = chars.astype(np.uint8) | np.where(more, CONTINUATION, 0).astype(np.uint8)
+    chars += CHAR_OFFSET
+    used = positions[None, :] < groups[:, None]
+    return chars[used].tobytes().decode("ascii")
+
+
+def decode_numbers(encoded):
+    """Decode a string of unsigned integers, all at once"""
+    data = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64)
+    data -= CHAR_OFFSET
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+    if (data < 0).any() or (data > GROUP_MASK | CONTINUATION).any():
+        raise ValueError("Invalid character in encoded data")
+    ends = np.flatnonzero((data & CONTINUATION) == 0)
+    if not len(ends) or ends[-1] != len(data) - 1:
+        raise ValueError("Truncated encoded data")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    groups = (data & GROUP_MASK).astype(np.uint64) << (positions * GROUP_BITS).astype(
+        np.uint64
+    )
+    return np.add.reduceat(groups, starts)
+
+
+def zigzag_encode(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def zigzag_decode(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(
+        np.int64
+    )
+
+
+def encode_series(lats, lons, times):
+    """Encode a track, times in seconds and coordinates rounded to 1e-5
+    degrees, in the format of `GeoLocationSeries.__str__`"""
+    times = np.rint(np.asarray(times, dtype=float)).astype(np.int64)
+    lats = np.rint(np.asarray(lats, dtype=float) * COORDINATES_SCALE).astype(np.int64)
+    lons = np.rint(np.asarray(lons, dtype=float) * COORDINATES_SCALE).astype(np.int64)
+    time_deltas = np.diff(times, prepend=YEAR2010)
+    if (time_deltas < 0).any():
+        raise ValueError("Times must be sorted and after 2010")
+    numbers = np.empty((len(times), 3), dtype=np.uint64)
+    numbers[:, 0] = time_deltas
+    numbers[:, 1] = zigzag_encode(np.diff(lats, prepend=0))
+    numbers[:, 2] = zigzag_encode(np.diff(lons, prepend=0))
+    return encode_numbers(numbers.ravel())
+
+
+def decode_series(encoded):
+    """Decode a track encoded with `encode_series`, return arrays of
+    latitudes, longitudes and times"""
+    numbers = decode_numbers(encoded)
+    if len(numbers) % 3:
+        raise ValueError("Truncated encoded data")
+    numbers = numbers.reshape(-1, 3)
+    times = YEAR2010 + np.cumsum(numbers[:, 0].astype(np.int64))
+    lats = np.cumsum(zigzag_decode(numbers[:, 1])) / COORDINATES_SCALE
+    lons = np.cumsum(zigzag_decode(numbers[:, 2])) / COORDINATES_SCALE
+    return lats, lons, times
+
+
+def float_to_decimal(value):
+    """Decimal of the shortest representation of a float"""
+    return Decimal(repr(value))
+
+
+def normalize_latitudes(lats):
+    """Put latitudes in the -90, 90 range, as GeoCoordinates does"""
+    lats = np.asarray(lats, dtype=float)
+    out = (lats < -90) | (lats > 90)
+    if not out.any():
+        return lats
+    lat_mod = np.mod(lats + 90, 360)
+    return np.where(out, np.where(lat_mod >= 180, 270 - lat_mod, lat_mod - 90), lats)
+
+
+def normalize_longitudes(lons):
+    """Put longitudes in the -180, 180 range, as GeoCoordinates does"""
+    lons = np.asarray(lons, dtype=float)
+    out = (lons < -180) | (lons >= 180)
+    if not out.any():
+        return lons
+    return np.where(out, np.mod(lons + 180, 360) - 180, lons)
+
+
+def to_timestamp(value):
+    if isinstance(value, datetime):
+        return float(calendar.timegm(value.timetuple()))
+    return float(value)
+
+
 class GeoCoordinates(object):
+    __slots__ = ("_latitude", "_longitude")
+
     repr_re = re.compile(
         r"^(?P<latitude>^\-?\d{1,2}(\.\d+)?)," r"(?P<longitude>\-?1?\d{1,2}(\.\d+)?$)"
     )
-    _latitude = None
-    _longitude = None
 
     def __init__(self, *args):
         if len(args) > 2:
@@ -122,8 +238,9 @@ class GeoCoordinates(object):
 
 
 class GeoLocation(object):
+    __slots__ = ("_timestamp", "coordinates")
+
     def __init__(self, timestamp, coordinates):
-        self._timestamp = None
         self.timestamp = timestamp
         if isinstance(coordinates, GeoCoordinates):
             self.coordinates = coordinates
@@ -136,6 +253,21 @@ class GeoLocation(object):
                 "length 2."
             )
 
+    @classmethod
+    def from_values(cls, timestamp, latitude, longitude):
+        """Build a location from floats already in range, skipping the
+        parsing and normalization done by the constructor"""
+        coordinates = GeoCoordinates.__new__(GeoCoordinates)
+        coordinates._latitude = float_to_decimal(latitude)
+        coordinates._longitude = float_to_decimal(longitude)
+        location = cls.__new__(cls)
+        if timestamp.is_integer():
+            location._timestamp = Decimal(int(timestamp))
+        else:
+            location._timestamp = float_to_decimal(timestamp)
+        location.coordinates = coordinates
+        return location
+
     def get_datetime(self):
         return datetime.fromtimestamp(self._timestamp, utc)
 
@@ -179,198 +311,320 @@ class GeoLocation(object):
 
 
 class GeoLocationSeries(object):
+    """Locations sorted by timestamp
+
+    Timestamps, latitudes and longitudes are stored as columns of floats and
+    the GeoLocation items are only built when accessed.
+    """
+
+    __slots__ = ("_times", "_lats", "_lons")
+
     @staticmethod
     def check_instance(item):
         if not isinstance(item, GeoLocation):
             raise TypeError("item is not of type GeoLocation")
 
-    def __init__(self, lst):
+    def __init__(self, lst=()):
+        if isinstance(lst, GeoLocationSeries):
+            self._set_columns(lst._times.copy(), lst._lats.copy(), lst._lons.copy())
+            return
         if isinstance(lst, str):
-            lst = self.decode_str(lst)
-        decorated = sorted(lst)
-        self._keys = [item.timestamp for item in decorated]
-        self._items = [item for item in decorated]
+            lats, lons, times = decode_series(lst)
+            self._set_sorted(
+                times.astype(float),
+                normalize_latitudes(lats),
+                normalize_longitudes(lons),
+            )
+            return
+        lst = list(lst)
         for item in lst:
             self.check_instance(item)
+        n = len(lst)
+        self._set_sorted(
+            np.fromiter((item.timestamp for item in lst), float, n),
+            np.fromiter((item.coordinates.latitude for item in lst), float, n),
+            np.fromiter((item.coordinates.longitude for item in lst), float, n),
+        )
+
+    @classmethod
+    def from_arrays(cls, times, lats, lons):
+        """Build a series from columns of timestamps and coordinates"""
+        series = cls.__new__(cls)
+        series._set_sorted(
+            np.asarray(times, dtype=float),
+            normalize_latitudes(lats),
+            normalize_longitudes(lons),
+        )
+        return series
+
+    def _set_columns(self, times, lats, lons):
+        self._times = times
+        self._lats = lats
+        self._lons = lons
+
+    def _set_sorted(self, times, lats, lons):
+        # Stable, locations with equal timestamps keep their order
+        order = np.argsort(times, kind="stable")
+        self._set_columns(
+            np.ascontiguousarray(times[order], dtype=float),
+            np.ascontiguousarray(lats[order], dtype=float),
+            np.ascontiguousarray(lons[order], dtype=float),
+        )
+
+    def _location(self, i):
+        return GeoLocation.from_values(
+            self._times[i].item(), self._lats[i].item(), self._lons[i].item()
+        )
+
+    def _bisect(self, k):
+        k = to_timestamp(k)
+        return (
+            int(np.searchsorted(self._times, k, "left")),
+            int(np.searchsorted(self._times, k, "right")),
+        )
+
+    def _matches(self, item):
+        """Positions of the locations equal to item"""
+        self.check_instance(item)
+        i, j = self._bisect(item.timestamp)
+        same = (self._lats[i:j] == float(item.coordinates.latitude)) & (
+            self._lons[i:j] == float(item.coordinates.longitude)
+        )
+        return i + np.flatnonzero(same)
+
+    def _insert_at(self, i, item):
+        self._set_columns(
+            np.insert(self._times, i, float(item.timestamp)),
+            np.insert(self._lats, i, float(item.coordinates.latitude)),
+            np.insert(self._lons, i, float(item.coordinates.longitude)),
+        )
+
+    @property
+    def times(self):
+        return self._times
+
+    @property
+    def lats(self):
+        return self._lats
+
+    @property
+    def lons(self):
+        return self._lons
 
     def clear(self):
-        self.__init__([])
+        self._set_columns(np.empty(0), np.empty(0), np.empty(0))
 
     def copy(self):
         return self.__class__(self)
 
     def __len__(self):
-        return len(self._items)
+        return len(self._times)
 
     def __getitem__(self, i):
-        return self._items[i]
+        """Location at position i, or a series of the locations of a slice"""
+        if isinstance(i, slice):
+            series = self.__class__.__new__(self.__class__)
+            series._set_columns(
+                self._times[i].copy(), self._lats[i].copy(), self._lons[i].copy()
+            )
+            return series
+        return self._location(i)
 
     def __iter__(self):
-        return iter(self._items)
+        for t, lat, lon in zip(
+            self._times.tolist(), self._lats.tolist(), self._lons.tolist()
+        ):
+            yield GeoLocation.from_values(t, lat, lon)
 
     def __reversed__(self):
-        return reversed(self._items)
+        return iter(self[::-1])
 
     def __repr__(self):
-        return "%s(%r)" % (self.__class__.__name__, self._items)
+        return "%s(%r)" % (self.__class__.__name__, list(self))
 
     def __reduce__(self):
-        return self.__class__, self._items
+        return self.__class__.from_arrays, (self._times, self._lats, self._lons)
 
     def __contains__(self, item):
-        self.check_instance(item)
-        k = item.timestamp
-        i = bisect_left(self._keys, k)
-        j = bisect_right(self._keys, k)
-        return item in self._items[i:j]
+        return len(self._matches(item)) > 0
 
     def index(self, item):
         """Find the position of an item.  Raise ValueError if not found."""
-        self.check_instance(item)
-        k = item.timestamp
-        i = bisect_left(self._keys, k)
-        j = bisect_right(self._keys, k)
-        return self._items[i:j].index(item) + i
+        matches = self._matches(item)
+        if not len(matches):
+            raise ValueError("%r is not in series" % (item,))
+        return int(matches[0])
 
     def count(self, item):
         """Return number of occurrences of item"""
-        self.check_instance(item)
-        k = item.timestamp
-        i = bisect_left(self._keys, k)
-        j = bisect_right(self._keys, k)
-        return self._items[i:j].count(item)
+        return len(self._matches(item))
 
     def insert(self, item):
         """Insert a new item.  If equal keys are found, replace item"""
         self.check_instance(item)
-        k = item.timestamp
-        i = bisect_left(self._keys, k)
-        if i < len(self._keys) and self._keys[i] == k:
-            self._items[i] = item
+        i, j = self._bisect(item.timestamp)
+        if i < j:
+            self._lats[i] = float(item.coordinates.latitude)
+            self._lons[i] = float(item.coordinates.longitude)
         else:
-            self._keys.insert(i, k)
-            self._items.insert(i, item)
+            self._insert_at(i, item)
 
     def insert_right(self, item):
         """Insert a new item.  If equal keys are found, add to the right"""
         self.check_instance(item)
-        k = item.timestamp
-        i = bisect_right(self._keys, k)
-        self._keys.insert(i, k)
-        self._items.insert(i, item)
+        self._insert_at(self._bisect(item.timestamp)[1], item)
 
     def remove(self, item):
         """Remove first occurence of item.  Raise ValueError if not found"""
-        self.check_instance(item)
         i = self.index(item)
-        del self._keys[i]
-        del self._items[i]
+        self._set_columns(
+            np.delete(self._times, i),
+            np.delete(self._lats, i),
+            np.delete(self._lons, i),
+        )
 
     def find(self, k):
         """Return first item with a key == k.
         Raise ValueError if not found."""
-        i = bisect_left(self._keys, k)
-        if i != len(self) and self._keys[i] == k:
-            return self._items[i]
+        i, j = self._bisect(k)
+        if i < j:
+            return self._location(i)
         raise ValueError("No item found with key equal to: %r" % (k,))
 
     def find_lte(self, k):
         """Return last item with a key <= k.  Raise ValueError if not found."""
-        i = bisect_right(self._keys, k)
+        i = self._bisect(k)[1]
         if i:
-            return self._items[i - 1]
+            return self._location(i - 1)
         raise ValueError("No item found with key at or below: %r" % (k,))
 
     def find_lt(self, k):
         """Return last item with a key < k.  Raise ValueError if not found."""
-        i = bisect_left(self._keys, k)
+        i = self._bisect(k)[0]
         if i:
-            return self._items[i - 1]
+            return self._location(i - 1)
         raise ValueError("No item found with key below: %r" % (k,))
 
     def find_gte(self, k):
         """Return first item with a key >= equal to k.
         Raise ValueError if not found"""
-        i = bisect_left(self._keys, k)
+        i = self._bisect(k)[0]
         if i != len(self):
-            return self._items[i]
+            return self._location(i)
         raise ValueError("No item found with key at or above: %r" % (k,))
 
     def find_gt(self, k):
         """Return first item with a key > k.  Raise ValueError if not found"""
-        i = bisect_right(self._keys, k)
+        i = self._bisect(k)[1]
         if i != len(self):
-            return self._items[i]
+            return self._location(i)
         raise ValueError("No item found with key above: %r" % (k,))
 
+    def between(self, start=None, end=None):
+        """Series of the items with a key between start and end, included,
+        either bound can be None"""
+        i = 0 if start is None else self._bisect(start)[0]
+        j = len(self) if end is None else self._bisect(end)[1]
+        return self[i:j]
+
     def get_bounds(self):
-        north = -90
-        south = 90
-        east = -180
-        west = 180
-        start_t = float("inf")
-        end_t = -float("inf")
-        for pt in self:
-            coords = pt.coordinates
-            north = max(north, coords.latitude)
-            south = min(south, coords.latitude)
-            west = min(west, coords.longitude)
-            east = max(east, coords.longitude)
-            start_t = min(start_t, pt.timestamp)
-            end_t = max(end_t, pt.timestamp)
+        if not len(self):
+            return {
+                "start_timestamp": float("inf"),
+                "finish_timestamp": -float("inf"),
+                "north": -90,
+                "south": 90,
+                "west": 180,
+                "east": -180,
+            }
         return {
-            "start_timestamp": start_t,
-            "finish_timestamp": end_t,
-            "north": north,
-            "south": south,
-            "west": west,
-            "east": east,
+            "start_timestamp": self._location(0).timestamp,
+            "finish_timestamp": self._location(-1).timestamp,
+            "north": float_to_decimal(self._lats.max().item()),
+            "south": float_to_decimal(self._lats.min().item()),
+            "west": float_to_decimal(self._lons.min().item()),
+            "east": float_to_decimal(self._lons.max().item()),
         }
 
     def __str__(self):
-        result = ""
-        prev_tim = YEAR2010
-        prev_lat = 0
-        prev_lng = 0
-        for pt in self:
-            coord = pt.coordinates
-            tim_d = int(round(float(pt.timestamp) - prev_tim))
-            lat_d = int(round(1e5 * (float(coord.latitude) - prev_lat)))
-            lng_d = int(round(1e5 * (float(coord.longitude) - prev_lng)))
-            result += (
-                encode_unsigned_number(tim_d)
-                + encode_signed_number(lat_d)
-                + encode_signed_number(lng_d)
-            )
-            prev_tim += tim_d
-            prev_lat += lat_d / 1e5
-            prev_lng += lng_d / 1e5
-        return result
+        return encode_series(self._lats, self._lons, self._times)
 
     @staticmethod
     def decode_str(encoded):
-        result = []
-        tim = YEAR2010
-        lat = 0
-        lon = 0
-        while len(encoded) > 0:
-            tim_d, encoded = decode_unsigned_number(encoded)
-            lat_d, encoded = decode_signed_number(encoded)
-            lon_d, encoded = decode_signed_number(encoded)
-            tim += tim_d
-            lat += lat_d
-            lon += lon_d
-            result.append(GeoLocation(tim, (lat / 1e5, lon / 1e5)))
-        return result
+        lats, lons, times = decode_series(encoded)
+        return [
+            GeoLocation.from_values(float(tim), lat, lon)
+            for lat, lon, tim in zip(
+                normalize_latitudes(lats).tolist(),
+                normalize_longitudes(lons).tolist(),
+                times.tolist(),
+            )
+        ]
 
     def __eq__(self, other):
-        return isinstance(other, GeoLocationSeries) and self._items == other._items
+        return (
+            isinstance(other, GeoLocationSeries)
+            and np.array_equal(self._times, other._times)
+            and np.array_equal(self._lats, other._lats)
+            and np.array_equal(self._lons, other._lons)
+        )
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    @classmethod
+    def _as_series(cls, items):
+        if isinstance(items, GeoLocationSeries):
+            return items
+        return cls(items)
+
+    def bulk_insert(self, items):
+        """Insert many items, the same as calling `insert` for each of them
+        in order but in linear time: an item replaces the first item of
+        equal key, and only the last of the given items of a key is kept"""
+        other = self._as_series(items)
+        if not len(other):
+            return
+        # Last of each run of equal keys, as it would replace the others
+        last = np.append(other._times[1:] != other._times[:-1], True)
+        times = other._times[last]
+        lats = other._lats[last]
+        lons = other._lons[last]
+        positions = np.searchsorted(self._times, times, "left")
+        found = positions < len(self)
+        found[found] = self._times[positions[found]] == times[found]
+        self._lats[positions[found]] = lats[found]
+        self._lons[positions[found]] = lons[found]
+        new = ~found
+        if new.any():
+            self._set_columns(
+                np.insert(self._times, positions[new], times[new]),
+                np.insert(self._lats, positions[new], lats[new]),
+                np.insert(self._lons, positions[new], lons[new]),
+            )
+
+    def extend_sorted(self, items):
+        """Append items sorted by key, none with a key lower than the last
+        key of the series.  Equal keys are kept, as with `insert_right`"""
+        if isinstance(items, GeoLocationSeries):
+            other = items
+        else:
+            items = list(items)
+            other = self.__class__(items)
+            times = np.fromiter((item.timestamp for item in items), float, len(items))
+            if (np.diff(times) < 0).any():
+                raise ValueError("Items are not sorted by key")
+        if len(self) and len(other) and other._times[0] < self._times[-1]:
+            raise ValueError("Items have keys lower than the last key of the series")
+        self._set_columns(
+            np.concatenate((self._times, other._times)),
+            np.concatenate((self._lats, other._lats)),
+            np.concatenate((self._lons, other._lons)),
+        )
+
     def union(self, other):
+        """Merge two series, items of `other` replacing the items of equal
+        key, see `bulk_insert`"""
         out = self.copy()
-        for item in other._items:
-            out.insert(item)
+        out.bulk_insert(other)
         return out
@@ -0,0 +1,62 @@
+"""GPX writer, formats the same documents as gpxpy without building them
+in memory"""
+
+import numpy as np
+
+GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx xmlns="http://www.topografix.com/GPX/1/1" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 '
+    'http://www.topografix.com/GPX/1/1/gpx.xsd" version="1.1" '
+    'creator="Mapdump.com">\n'
+    "  <trk>\n"
+    "    <trkseg>\n"
+)
+GPX_FOOTER = "    </trkseg>\n  </trk>\n</gpx>"
+POINTS_PER_CHUNK = 2000
+
+
+def format_coordinate(value):
+    """Coordinate as gpxpy writes it, scientific notation is invalid in GPX"""
+    if value == 0:
+        # gpxpy stores a zero coordinate as the integer 0
+        return "0"
+    result = str(value)
+    if "e" not in result:
+        return result
+    return format(value, ".10f").rstrip("0").rstrip(".")
+
+
+def format_times(times):
+    """ISO 8601 UTC strings of epoch `times`, empty where the time is unknown"""
+    known = ~np.isnan(times) & (times != 0)
+    micros = np.where(known, np.round(times * 1e6), 0).astype("datetime64[us]")
+    seconds = np.datetime_as_string(micros, unit="s")
+    fractions = np.datetime_as_string(micros, unit="us")
+    whole = micros.astype("datetime64[s]") == micros
+    formatted = np.char.add(np.where(whole, seconds, fractions), "Z")
+    return np.where(known, formatted, "")
+
+
+def iter_gpx(track, points_per_chunk=POINTS_PER_CHUNK):
+    """Yield the GPX document of a `utils.track.Track` in chunks"""
+    yield GPX_HEADER
+    for start in range(0, len(track), points_per_chunk):
+        end = start + points_per_chunk
+        times = format_times(track.times[start:end])
+        lines = []
+        for lat, lon, time in zip(
+            track.lats[start:end].tolist(),
+            track.lons[start:end].tolist(),
+            times.tolist(),
+        ):
+            lines.append(
+                f'      <trkpt lat="{format_coordinate(lat)}" '
+                f'lon="{format_coordinate(lon)}">\n'
+            )
+            if time:
+                lines.append(f"        <time>{time}</time>\n")
+            lines.append("      </trkpt>\n")
+        yield "".join(lines)
+    yield GPX_FOOTER
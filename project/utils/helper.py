@@ -1,25 +1,177 @@
 import base64
+import csv
+import gc
+import os
 import secrets
 import struct
+import threading
 import time
+from collections import OrderedDict
 
+import numpy as np
 import requests
 import reverse_geocoder
+from django.conf import settings
 from django.utils.dateparse import parse_datetime
 from django.utils.timezone import is_aware, make_aware
+from scipy.spatial import cKDTree
 from timezonefinder import TimezoneFinder
+from timezonefinder.configs import BINARY_FILE_ENDING
 from utils.globalmaptiles import GlobalMercator
 from utils.random_strings import generate_random_string
 from utils.validators import validate_nice_slug
 
 
+class CoordinatesCache(object):
+    """LRU cache of lookups by coordinates
+
+    Lookups are made at coordinates rounded to a grid, once per grid cell,
+    and under a lock as some finders are not thread safe.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = OrderedDict()
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def get_many(self, coords, lookup_many, grid, size):
+        keys = [
+            (round(float(lat) / grid), round(float(lng) / grid)) for lat, lng in coords
+        ]
+        result = {}
+        with self.lock:
+            for key in keys:
+                if key not in result and key in self.values:
+                    self.values.move_to_end(key)
+                    result[key] = self.values[key]
+            missing = [key for key in dict.fromkeys(keys) if key not in result]
+            if missing:
+                points = [
+                    (round(lat * grid, 9), round(lng * grid, 9)) for lat, lng in missing
+                ]
+                for key, value in zip(missing, lookup_many(points)):
+                    result[key] = self.values[key] = value
+                while len(self.values) > size:
+                    self.values.popitem(last=False)
+        return [result[key] for key in keys]
+
+
+_timezone_finder = None
+_timezone_finder_pid = None
+_timezones = CoordinatesCache()
+_country_finder = None
+_countries = CoordinatesCache()
+
+
+def get_timezone_finder():
+    """Return the TimezoneFinder of the current process
+
+    Unless TZ_FINDER_IN_MEMORY, the finder reads its files at offsets shared
+    with a forked child (eg: uWSGI workers), each process then opens the
+    files again but keeps the rest of the finder loaded by its parent.
+    """
+    global _timezone_finder, _timezone_finder_pid
+    if _timezone_finder is None:
+        _timezone_finder = TimezoneFinder(in_memory=settings.TZ_FINDER_IN_MEMORY)
+    elif _timezone_finder_pid != os.getpid() and not _timezone_finder.in_memory:
+        for name in _timezone_finder.binary_data_attributes:
+            getattr(_timezone_finder, name).close()
+            path = _timezone_finder.bin_file_location / f"{name}{BINARY_FILE_ENDING}"
+            setattr(_timezone_finder, name, open(path, "rb"))
+    _timezone_finder_pid = os.getpid()
+    return _timezone_finder
+
+
+def clear_tz_cache():
+    _timezones.clear()
+
+
+def tz_at_coords_many(coords):
+    """Return the timezone names at a list of (lat, lng), None if unknown
+
+    Timezones are looked up at coordinates rounded to TZ_CACHE_GRID degrees
+    and cached.
+    """
+
+    def lookup_many(points):
+        tf = get_timezone_finder()
+        return [tf.timezone_at(lng=lng, lat=lat) for lat, lng in points]
+
+    return _timezones.get_many(
+        coords, lookup_many, settings.TZ_CACHE_GRID, settings.TZ_CACHE_SIZE
+    )
+
+
 def tz_at_coords(lat, lng):
-    tf = TimezoneFinder()
-    return tf.timezone_at(lng=lng, lat=lat)
+    return tz_at_coords_many([(lat, lng)])[0]
+
+
+class CountryFinder(object):
+    """Country of the nearest town of more than 1000 inhabitants
+
+    Same data and nearest neighbour search as `reverse_geocoder.search` in
+    single process mode, but only the country codes of the towns are kept.
+    """
+
+    def __init__(self):
+        path = reverse_geocoder.rel_path(reverse_geocoder.RG_FILE)
+        coords = []
+        codes = []
+        with open(path, newline="", encoding="utf-8") as fp:
+            for row in csv.DictReader(fp):
+                coords.append((float(row["lat"]), float(row["lon"])))
+                codes.append(row["cc"])
+        self.tree = cKDTree(np.array(coords))
+        self.codes = np.array(codes)
+
+    def query(self, coords):
+        """Return the country codes at a list of (lat, lng)"""
+        _, indices = self.tree.query(np.asarray(coords, dtype=float).reshape(-1, 2))
+        return self.codes[indices].tolist()
+
+
+def get_country_finder():
+    """Return the CountryFinder of the process, its k-d tree is read only
+    and can be shared with forked children"""
+    global _country_finder
+    if _country_finder is None:
+        _country_finder = CountryFinder()
+    return _country_finder
+
+
+def clear_country_cache():
+    _countries.clear()
+
+
+def country_at_coords_many(coords):
+    """Return the country codes at a list of (lat, lng)
+
+    Countries are looked up at coordinates rounded to COUNTRY_CACHE_GRID
+    degrees and cached.
+    """
+    return _countries.get_many(
+        coords,
+        lambda points: get_country_finder().query(points),
+        settings.COUNTRY_CACHE_GRID,
+        settings.COUNTRY_CACHE_SIZE,
+    )
 
 
 def country_at_coords(lat, lng):
-    return reverse_geocoder.search((lat, lng))[0].get("cc")
+    return country_at_coords_many([(lat, lng)])[0]
+
+
+def preload_geodata():
+    """Load the timezone and country finders, eg: in the uWSGI master so
+    that the workers it forks share them instead of each loading its own"""
+    get_timezone_finder()
+    get_country_finder()
+    # Objects loaded so far are left alone by the garbage collector, which
+    # would otherwise write to their pages and unshare them
+    gc.freeze()
 
 
 def get_aware_datetime(date_str):
@@ -0,0 +1,396 @@
+"""Python port of jstools/drawHelpers.js `drawRoute`
+
+Draws the route of a runner on top of its map, using NumPy to project and
+measure the route and Pillow to draw it.
+"""
+
+import math
+from datetime import datetime
+from io import BytesIO
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from utils.helper import general_2d_projection
+
+MAX_CANVAS_SIZE = 32767
+EARTH_RADIUS = 6378137
+HEADER_HEIGHT = 70
+PALETTE_WIDTH = 180
+PALETTE_X = 40
+PALETTE_Y = 30
+PALETTE_LINE_WIDTH = 16
+PALETTE_STOPS = ((0.0, (255, 0, 0)), (0.5, (255, 255, 0)), (1.0, (0, 136, 0)))
+FONT_NAMES = ("Arial.ttf", "arial.ttf", "DejaVuSans.ttf")
+# Largest difference accepted between an image drawn here and the node one,
+# mean over all channels out of 255 and percentage of pixels off by >32
+MAX_MEAN_DIFF = 3.0
+MAX_PIXELS_OFF = 2.0
+
+
+def latlon_to_meters(lats, lons):
+    c = math.pi / 180
+    x = lons * EARTH_RADIUS * c
+    y = np.log(np.tan((90 + lats) * c / 2)) * EARTH_RADIUS
+    return x, y
+
+
+def corners_to_array(corners):
+    return np.array(
+        [
+            corners["top_left"],
+            corners["top_right"],
+            corners["bottom_right"],
+            corners["bottom_left"],
+        ],
+        dtype=float,
+    )
+
+
+def corners_to_dict(corners):
+    return {
+        "top_left": corners[0].tolist(),
+        "top_right": corners[1].tolist(),
+        "bottom_right": corners[2].tolist(),
+        "bottom_left": corners[3].tolist(),
+    }
+
+
+def corner_cal_matrix(width, height, corners):
+    xs, ys = latlon_to_meters(corners[:, 0], corners[:, 1])
+    matrix = general_2d_projection(
+        *(xs[0], ys[0], 0, 0),
+        *(xs[1], ys[1], width, 0),
+        *(xs[2], ys[2], width, height),
+        *(xs[3], ys[3], 0, height),
+    )
+    return np.array(matrix).reshape(3, 3)
+
+
+def project(matrix, lats, lons):
+    """Project arrays of coordinates to map pixels coordinates"""
+    xs, ys = latlon_to_meters(lats, lons)
+    v = matrix @ np.vstack((xs, ys, np.ones_like(xs)))
+    return v[0] / v[2], v[1] / v[2]
+
+
+def get_resolution(width, height, corners):
+    matrix = corner_cal_matrix(width, height, corners)
+    px, py = project(matrix, corners[:, 0], corners[:, 1])
+    mx, my = latlon_to_meters(corners[:, 0], corners[:, 1])
+    res_a = math.hypot(mx[0] - mx[2], my[0] - my[2]) / math.hypot(
+        px[0] - px[2], py[0] - py[2]
+    )
+    res_b = math.hypot(mx[1] - mx[3], my[1] - my[3]) / math.hypot(
+        px[1] - px[3], py[1] - py[3]
+    )
+    return (res_a + res_b) / 2
+
+
+def extract_speeds(cum_dist, times):
+    """Speeds in km/h, averaged on a sliding window of 10 points"""
+    n = len(cum_dist)
+    idx = np.arange(n)
+    min_idx = np.maximum(idx - 10, 0)
+    max_idx = np.minimum(min_idx + 10, n - 1)
+    last_idx = np.maximum(max_idx - 1, min_idx)
+    dist = cum_dist[last_idx] - cum_dist[min_idx]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speeds = dist / (times[max_idx] - times[min_idx]) * 3600
+    # Unknown speeds take the value of the previous point
+    valid = ~np.isnan(speeds)
+    if not valid.all():
+        speeds = np.concatenate(([1.0], speeds))
+        valid = np.concatenate(([True], valid))
+        fill_idx = np.maximum.accumulate(np.where(valid, np.arange(n + 1), 0))
+        speeds = speeds[fill_idx][1:]
+    return speeds
+
+
+def build_palette():
+    positions = (np.arange(256) + 0.5) / 256
+    stops = [s[0] for s in PALETTE_STOPS]
+    return np.stack(
+        [
+            np.interp(positions, stops, [s[1][channel] for s in PALETTE_STOPS])
+            for channel in range(3)
+        ],
+        axis=1,
+    ).astype(np.uint8)
+
+
+PALETTE = build_palette()
+
+
+def colors_for_percents(percents):
+    idx = np.minimum(np.floor(percents * 256), 255).astype(int)
+    return PALETTE[idx]
+
+
+def colors_for_speeds(speeds, min_speed, max_speed):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relative = np.clip((speeds - min_speed) / (max_speed - min_speed), 0, 0.999)
+    relative[np.isnan(relative)] = 0
+    return colors_for_percents(relative)
+
+
+def get_font(size):
+    for name in FONT_NAMES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            pass
+    return ImageFont.load_default()
+
+
+def draw_text(draw, xy, text, font, anchor="ls"):
+    if isinstance(font, ImageFont.FreeTypeFont):
+        draw.text(xy, text, font=font, fill="white", anchor=anchor)
+        return
+    x, y = xy
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    if anchor[0] == "m":
+        x -= (right - left) / 2
+    draw.text((x, y - bottom), text, font=font, fill="white")
+
+
+def speed_text(speed):
+    return f"{speed:.2f}km/h"
+
+
+def print_time(duration):
+    seconds = int(duration / 1e3)
+    h = seconds // 3600 % 24
+    m = seconds // 60 % 60
+    s = seconds % 60
+    has_h = h > 0
+    has_m = has_h or m > 0
+    has_s = has_m or s > 0
+    h_part = f"{h}h" if has_h else ""
+    m_part = f"{m}m" if has_m else ""
+    if has_h:
+        m_part = m_part.rjust(3, "0")
+    s_part = f"{s}s" if has_s else ""
+    if has_m:
+        s_part = s_part.rjust(3, "0")
+    return h_part + m_part + s_part
+
+
+def format_start_time(timestamp, tz):
+    try:
+        zone = ZoneInfo(tz)
+    except Exception:
+        zone = ZoneInfo("UTC")
+    date = datetime.fromtimestamp(timestamp, zone)
+    return date.strftime(f"%A, %B {date.day}, %Y at %H:%M:%S %Z")
+
+
+def extract_bounds(width, height, xs, ys):
+    return (
+        math.floor(xs.min(initial=0)),
+        math.ceil(xs.max(initial=width)),
+        math.floor(ys.min(initial=0)),
+        math.ceil(ys.max(initial=height)),
+    )
+
+
+def thin_polyline(points, min_distance):
+    """Keep only the points further than `min_distance` from the previously
+    kept point"""
+    kept = []
+    prev = None
+    for x, y in points:
+        if prev is None or math.hypot(prev[0] - x, prev[1] - y) > min_distance:
+            kept.append((x, y))
+            prev = (x, y)
+    return kept
+
+
+def draw_route(img, corners, track, include_header=False, include_route=True, tz="UTC"):
+    """Return a new image of the map with the route drawn on it
+
+    `corners` is the map bounds dict and `track` a `utils.track.Track`.
+    """
+    corners = corners_to_array(corners)
+    lats = track.lats
+    lons = track.lons
+    times = np.nan_to_num(track.times) * 1e3
+    has_time = track.has_time
+
+    matrix = corner_cal_matrix(img.width, img.height, corners)
+    xs, ys = project(matrix, lats, lons)
+    min_x, max_x, min_y, max_y = extract_bounds(img.width, img.height, xs, ys)
+    m_width = max_x - min_x
+    m_height = max_y - min_y
+
+    if m_width > MAX_CANVAS_SIZE or m_height > MAX_CANVAS_SIZE:
+        ratio = MAX_CANVAS_SIZE / max(m_width, m_height)
+        scaled = img.resize(
+            (math.floor(img.width * ratio), math.floor(img.height * ratio))
+        )
+        return draw_route(
+            scaled,
+            corners_to_dict(corners),
+            track,
+            include_header,
+            include_route,
+            tz,
+        )
+
+    resolution = get_resolution(img.width, img.height, corners) / 1.702
+    canvas = Image.new("RGB", (m_width, m_height), "white")
+    if img.mode == "RGBA":
+        canvas.paste(img, (-min_x, -min_y), img)
+    else:
+        canvas.paste(img.convert("RGB"), (-min_x, -min_y))
+
+    outline_width = 2 / resolution
+    weight = 4 / resolution
+
+    metrics = track.metrics
+    speeds = extract_speeds(metrics.cumulative_distances, times)
+    min_speed = max_speed = None
+    if len(speeds):
+        avg_speed = speeds.mean()
+        std_dev = speeds.std()
+        min_speed = avg_speed - std_dev
+        max_speed = avg_speed + std_dev
+
+    if include_route and len(track):
+        pts_x = np.round(xs - min_x)
+        pts_y = np.round(ys - min_y)
+        points = list(zip(pts_x.tolist(), pts_y.tolist()))
+        line_width = max(1, round(weight))
+
+        # Outline, a black line whose center is emptied
+        outline = Image.new("L", canvas.size, 0)
+        outline_draw = ImageDraw.Draw(outline)
+        thinned = thin_polyline(points, weight)
+        outline_draw.line(
+            thinned,
+            fill=255,
+            width=max(1, round(weight + 2 * outline_width)),
+            joint="curve",
+        )
+        outline_draw.line(thinned, fill=0, width=line_width, joint="curve")
+
+        # Colored path, consecutive segments of a same color drawn at once
+        path = Image.new("RGBA", canvas.size, (0, 0, 0, 0))
+        path_draw = ImageDraw.Draw(path)
+        colors = colors_for_speeds(speeds, min_speed, max_speed).astype(int)
+        segment_colors = (colors[:-1] + colors[1:]) // 2
+        if len(segment_colors):
+            changes = np.flatnonzero(np.any(np.diff(segment_colors, axis=0), axis=1))
+            starts = np.concatenate(([0], changes + 1))
+            ends = np.concatenate((changes + 1, [len(segment_colors)]))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                path_draw.line(
+                    points[start : end + 1],
+                    fill=tuple(segment_colors[start]) + (255,),
+                    width=line_width,
+                    joint="curve",
+                )
+
+        # Time markers, every 10 seconds and a bigger one every minute
+        if has_time:
+            prev_t = times[0] - 20e3
+            count = 0
+            for j, t in enumerate(times.tolist()):
+                if t >= prev_t + 10e3:
+                    radius = (3 if count % 6 == 0 else 1) / resolution
+                    radius += 0.5 / resolution
+                    x, y = points[j]
+                    outline_draw.ellipse(
+                        (x - radius, y - radius, x + radius, y + radius), fill=255
+                    )
+                    prev_t = t
+                    count += 1
+
+        path.putalpha(path.getchannel("A").point(lambda a: round(a * 0.45)))
+        canvas = canvas.convert("RGBA")
+        canvas.alpha_composite(path)
+        black = Image.new("RGB", canvas.size, "black")
+        canvas = Image.composite(
+            black,
+            canvas.convert("RGB"),
+            outline.point(lambda a: round(a * 0.7)),
+        )
+
+    if include_header:
+        header = Image.new("RGB", (canvas.width, canvas.height + HEADER_HEIGHT))
+        header.paste(canvas, (0, HEADER_HEIGHT))
+        draw = ImageDraw.Draw(header)
+        draw.rectangle((0, 0, canvas.width, HEADER_HEIGHT - 1), fill="#222")
+        font = get_font(15)
+        if include_route and has_time:
+            gradient = colors_for_percents(
+                np.clip(np.arange(PALETTE_WIDTH) / PALETTE_WIDTH, 0, 0.999)
+            )
+            bar = Image.fromarray(
+                np.repeat(gradient[np.newaxis], PALETTE_LINE_WIDTH, axis=0)
+            )
+            header.paste(bar, (PALETTE_X, PALETTE_Y - PALETTE_LINE_WIDTH // 2))
+            mid_x = PALETTE_X + PALETTE_WIDTH // 2
+            draw.line(
+                (
+                    mid_x,
+                    PALETTE_Y - PALETTE_LINE_WIDTH // 2,
+                    mid_x,
+                    PALETTE_Y + PALETTE_LINE_WIDTH // 2,
+                ),
+                fill="#222",
+            )
+            text_y = PALETTE_Y + PALETTE_LINE_WIDTH // 2 + 15
+            for x, speed in (
+                (PALETTE_X, min_speed),
+                (mid_x, (max_speed + min_speed) / 2),
+                (PALETTE_X + PALETTE_WIDTH, max_speed),
+            ):
+                draw_text(draw, (x, text_y), speed_text(speed), font, "ms")
+
+            distance = metrics.distance
+            info_x = PALETTE_X + PALETTE_WIDTH + 35
+            draw_text(draw, (info_x, PALETTE_Y), f"{distance / 1e3:.3f}km", font)
+            draw_text(
+                draw,
+                (info_x + 80, PALETTE_Y),
+                print_time(times[-1] - times[0]),
+                font,
+            )
+            draw_text(
+                draw,
+                (info_x, PALETTE_Y + 20),
+                format_start_time(track.start_time, tz),
+                font,
+            )
+        draw_text(
+            draw,
+            (canvas.width - 400, HEADER_HEIGHT - 17),
+            "mapdump.com",
+            get_font(60),
+        )
+        return header
+    return canvas.convert("RGB")
+
+
+def render_route_image(image_data, corners, track, arg, tz):
+    """Python counterpart of jstools/render_worker.js, return JPEG bytes"""
+    with Image.open(BytesIO(image_data)) as img:
+        img.load()
+        out = draw_route(img, corners, track, "h" in arg, "r" in arg, tz)
+    buffer = BytesIO()
+    out.save(buffer, "JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def image_difference(reference, image):
+    """Mean difference, out of 255, and percentage of pixels off by more than
+    32 of two encoded images of the same size"""
+    with Image.open(BytesIO(reference)) as ref_img, Image.open(BytesIO(image)) as img:
+        if ref_img.size != img.size:
+            raise ValueError(f"Images sizes differ: {ref_img.size}, {img.size}")
+        diff = np.abs(
+            np.asarray(ref_img.convert("RGB"), dtype=np.int16)
+            - np.asarray(img.convert("RGB"), dtype=np.int16)
+        )
+    return float(diff.mean()), float((diff.max(axis=2) > 32).mean() * 100)
@@ -0,0 +1,268 @@
+import json
+import os
+import select
+import struct
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+FRAME_HEADER = struct.Struct(">I")
+RENDER_POOL_PIDS_KEY = "render_pool_pids"
+
+
+class RenderError(Exception):
+    pass
+
+
+class RenderTimeout(RenderError):
+    pass
+
+
+class RenderWorker(object):
+    """A long lived `node render_worker.js` process
+
+    Jobs and results are exchanged over the process stdin/stdout as length
+    prefixed frames, see jstools/render_worker.js for the protocol.
+    """
+
+    def __init__(self):
+        self.jobs = 0
+        self.rss = 0
+        self.process = subprocess.Popen(
+            [settings.NODEJS_PATH, "render_worker.js"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=os.path.join(settings.BASE_DIR, "jstools"),
+            env=dict(os.environ, NODE_OPTIONS="--openssl-legacy-provider"),
+        )
+        # Writes wait for the pipe with the job deadline, see write_exact
+        os.set_blocking(self.process.stdin.fileno(), False)
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def write_exact(self, data, deadline):
+        fd = self.process.stdin.fileno()
+        view = memoryview(data)
+        while view:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RenderTimeout("Render job timed out")
+            _, ready, _ = select.select([], [fd], [], remaining)
+            if not ready:
+                continue
+            try:
+                written = os.write(fd, view[: 2**20])
+            except BlockingIOError:
+                continue
+            view = view[written:]
+
+    def write_frame(self, data, deadline):
+        self.write_exact(FRAME_HEADER.pack(len(data)), deadline)
+        self.write_exact(data, deadline)
+
+    def read_exact(self, size, deadline):
+        fd = self.process.stdout.fileno()
+        chunks = []
+        while size > 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RenderTimeout("Render job timed out")
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, min(size, 2**20))
+            if not chunk:
+                raise RenderError("Render worker exited unexpectedly")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def read_frame(self, deadline):
+        (size,) = FRAME_HEADER.unpack(self.read_exact(FRAME_HEADER.size, deadline))
+        return self.read_exact(size, deadline)
+
+    def render(self, header, route_json, image, timeout):
+        deadline = time.monotonic() + timeout
+        self.jobs += 1
+        try:
+            self.write_frame(json.dumps(header).encode("utf-8"), deadline)
+            self.write_frame(route_json, deadline)
+            self.write_frame(image, deadline)
+        except (BrokenPipeError, ValueError):
+            raise RenderError("Render worker exited unexpectedly")
+        status = json.loads(self.read_frame(deadline))
+        data = self.read_frame(deadline)
+        self.rss = status.get("rss", 0)
+        if not status.get("ok"):
+            raise RenderError(status.get("error", "Unknown render error"))
+        return data
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class RenderPool(object):
+    """Pool of render workers, started lazily and recycled after `max_jobs`
+    jobs or once their memory usage goes above `max_rss` bytes.
+    """
+
+    def __init__(self, size, max_jobs, max_rss, timeout):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._busy = 0
+        self._counters = {"jobs": 0, "failures": 0, "timeouts": 0, "recycled": 0}
+
+    @property
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "size": self.size,
+            "idle": len(self._idle),
+            "busy": self._busy,
+            **self._counters,
+        }
+
+    def publish_stats(self):
+        """Share the stats of this process pool, see `render_pool_stats`"""
+        pid = os.getpid()
+        try:
+            cache.set(
+                f"render_pool_stats_{pid}",
+                self.stats,
+                settings.RENDER_POOL_STATS_TIMEOUT,
+            )
+            pids = cache.get(RENDER_POOL_PIDS_KEY) or []
+            if pid not in pids:
+                cache.set(RENDER_POOL_PIDS_KEY, pids + [pid], None)
+        except Exception:
+            pass
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise RenderTimeout("No render worker available")
+        with self._lock:
+            self._busy += 1
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive:
+                    return worker
+                worker.close()
+        try:
+            return RenderWorker()
+        except Exception:
+            self._release(None)
+            raise
+
+    def _release(self, worker):
+        if worker is not None and (
+            not worker.alive
+            or worker.jobs >= self.max_jobs
+            or worker.rss >= self.max_rss
+        ):
+            worker.close()
+            worker = None
+            with self._lock:
+                self._counters["recycled"] += 1
+        with self._lock:
+            self._busy -= 1
+            if worker is not None:
+                self._idle.append(worker)
+        self._slots.release()
+
+    def render(self, header, route_json, image):
+        worker = self._acquire()
+        with self._lock:
+            self._counters["jobs"] += 1
+        try:
+            return worker.render(header, route_json, image, self.timeout)
+        except Exception as e:
+            with self._lock:
+                self._counters["failures"] += 1
+                if isinstance(e, RenderTimeout):
+                    self._counters["timeouts"] += 1
+            # The worker state is unknown, do not reuse it.
+            worker.close()
+            worker = None
+            raise
+        finally:
+            self._release(worker)
+            self.publish_stats()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
+
+
+_pool = None
+_pool_pid = None
+
+
+def get_render_pool():
+    """Return the render pool of the current process
+
+    Pools are never shared with a forked child (eg: uWSGI workers), each
+    process gets its own.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = RenderPool(
+            size=settings.RENDER_POOL_SIZE,
+            max_jobs=settings.RENDER_WORKER_MAX_JOBS,
+            max_rss=settings.RENDER_WORKER_MAX_RSS,
+            timeout=settings.RENDER_JOB_TIMEOUT,
+        )
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def render_pool_stats():
+    """Stats of the render pools of all the processes of this host which
+    rendered an image lately, one entry per process, and their totals"""
+    pids = cache.get(RENDER_POOL_PIDS_KEY) or []
+    workers = []
+    for pid in pids:
+        stats = cache.get(f"render_pool_stats_{pid}")
+        if stats is not None and pid_alive(pid):
+            workers.append(stats)
+    live_pids = [stats["pid"] for stats in workers]
+    if live_pids != pids:
+        try:
+            cache.set(RENDER_POOL_PIDS_KEY, live_pids, None)
+        except Exception:
+            pass
+    totals = {
+        name: sum(stats[name] for stats in workers)
+        for name in ("size", "idle", "busy", "jobs", "failures", "timeouts", "recycled")
+    }
+    return {"workers": workers, "totals": totals}
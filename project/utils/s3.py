@@ -1,21 +1,62 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
 import boto3
+from botocore.config import Config
 from django.conf import settings
 
+_client = None
+_client_pid = None
+_urls = OrderedDict()
+_urls_lock = threading.Lock()
+
 
 def get_s3_client():
-    return boto3.client(
-        "s3",
-        endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    )
+    """Return the S3 client of the current process
+
+    boto3 clients are thread safe but must not be shared with a forked child
+    (eg: uWSGI workers), each process gets its own.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = boto3.client(
+            "s3",
+            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            config=Config(max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS),
+        )
+        _client_pid = os.getpid()
+        _urls.clear()
+    return _client
 
 
 def s3_object_url(key, bucket):
+    """Return a presigned GET url of the object
+
+    Urls are reused for S3_URL_CACHE_TIMEOUT seconds, well within their
+    S3_URL_EXPIRES validity.
+    """
     s3 = get_s3_client()
-    return s3.generate_presigned_url(
-        ClientMethod="get_object", Params={"Bucket": bucket, "Key": key}
+    now = time.monotonic()
+    with _urls_lock:
+        cached = _urls.get((bucket, key))
+        if cached and cached[1] > now:
+            _urls.move_to_end((bucket, key))
+            return cached[0]
+    url = s3.generate_presigned_url(
+        ClientMethod="get_object",
+        Params={"Bucket": bucket, "Key": key},
+        ExpiresIn=settings.S3_URL_EXPIRES,
     )
+    with _urls_lock:
+        _urls[(bucket, key)] = (url, now + settings.S3_URL_CACHE_TIMEOUT)
+        _urls.move_to_end((bucket, key))
+        while len(_urls) > settings.S3_URL_CACHE_SIZE:
+            _urls.popitem(last=False)
+    return url
 
 
 def s3_key_exists(key, bucket):
@@ -36,8 +77,16 @@ def s3_delete_key(key, bucket):
         Bucket=bucket,
         Key=key,
     )
+    with _urls_lock:
+        _urls.pop((bucket, key), None)
+
+
+def upload_to_s3(bucket, key, fileobj, content_type=None):
+    s3 = get_s3_client()
+    extra_args = {"ContentType": content_type} if content_type else None
+    s3.upload_fileobj(fileobj, bucket, key, ExtraArgs=extra_args)
 
 
-def upload_to_s3(bucket, key, fileobj):
+def s3_get_object(key, bucket):
     s3 = get_s3_client()
-    s3.upload_fileobj(fileobj, bucket, key)
+    return s3.get_object(Bucket=bucket, Key=key)["Body"].read()
@@ -0,0 +1,142 @@
+import json
+import struct
+import zlib
+
+import numpy as np
+from utils.track_metrics import TrackMetrics
+
+# Binary format, a version byte followed by the zlib compressed:
+#   header: number of points (uint32), flags (uint8)
+#   latitudes, longitudes and times columns
+#   bitmap of the points without time, if FLAG_MISSING_TIMES is set
+# Columns are the deltas of the quantized values as int64, byte shuffled
+# (all the first bytes, then all the second bytes...) so that the mostly
+# zero high bytes compress well.
+FORMAT_VERSION = 1
+FORMAT_HEADER = struct.Struct("<IB")
+FLAG_MISSING_TIMES = 1
+COORDINATES_SCALE = 1e6  # ~0.1m
+TIMES_SCALE = 1e3  # milliseconds
+
+
+def pack_column(values, scale):
+    quantized = np.round(values * scale).astype("<i8")
+    deltas = np.diff(quantized, prepend=np.int64(0))
+    return deltas.view(np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def unpack_column(data, n, scale):
+    deltas = np.ascontiguousarray(np.frombuffer(data, np.uint8).reshape(8, n).T)
+    return np.cumsum(deltas.view("<i8").ravel()) / scale
+
+
+class Track(object):
+    """A route track stored as columns
+
+    `lats` and `lons` are in degrees, `times` in seconds since the epoch,
+    NaN where the time of a point is unknown.
+    """
+
+    __slots__ = ("lats", "lons", "times", "_metrics")
+
+    def __init__(self, lats, lons, times):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.times = np.asarray(times, dtype=float)
+        self._metrics = None
+
+    @classmethod
+    def from_points(cls, points):
+        """Build a track from a list of points formatted as in
+        `Route.route_json`, eg: [{"time": 1650000000, "latlon": [60.1, 22.2]}]
+        """
+        n = len(points)
+        lats = np.empty(n)
+        lons = np.empty(n)
+        times = np.empty(n)
+        for i, p in enumerate(points):
+            lats[i], lons[i] = p["latlon"]
+            times[i] = np.nan if p["time"] is None else p["time"]
+        return cls(lats, lons, times)
+
+    @classmethod
+    def from_json(cls, data):
+        return cls.from_points(json.loads(data))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Decode a track encoded with `to_bytes`"""
+        data = memoryview(data)
+        if not len(data) or data[0] != FORMAT_VERSION:
+            raise ValueError("Unsupported track format")
+        payload = zlib.decompress(data[1:])
+        n, flags = FORMAT_HEADER.unpack_from(payload)
+        offset = FORMAT_HEADER.size
+        column_size = 8 * n
+        columns = []
+        for scale in (COORDINATES_SCALE, COORDINATES_SCALE, TIMES_SCALE):
+            column = payload[offset : offset + column_size]
+            columns.append(unpack_column(column, n, scale))
+            offset += column_size
+        lats, lons, times = columns
+        if flags & FLAG_MISSING_TIMES:
+            missing = np.unpackbits(np.frombuffer(payload, np.uint8, offset=offset))
+            times[missing[:n].astype(bool)] = np.nan
+        return cls(lats, lons, times)
+
+    def to_bytes(self):
+        """Encode the track, coordinates are rounded to 1e-6 degrees and
+        times to the millisecond"""
+        missing = np.isnan(self.times)
+        flags = 0
+        times = self.times
+        if missing.any():
+            flags |= FLAG_MISSING_TIMES
+            # Unknown times take the previous known time, to keep deltas small
+            known_idx = np.maximum.accumulate(
+                np.where(missing, 0, np.arange(len(times)))
+            )
+            times = np.nan_to_num(times[known_idx])
+        payload = [
+            FORMAT_HEADER.pack(len(self), flags),
+            pack_column(self.lats, COORDINATES_SCALE),
+            pack_column(self.lons, COORDINATES_SCALE),
+            pack_column(times, TIMES_SCALE),
+        ]
+        if flags & FLAG_MISSING_TIMES:
+            payload.append(np.packbits(missing).tobytes())
+        return bytes([FORMAT_VERSION]) + zlib.compress(b"".join(payload))
+
+    def __len__(self):
+        return len(self.lats)
+
+    @property
+    def has_time(self):
+        """Whether the track is timed, ie: its first point has a time"""
+        return bool(len(self)) and not np.isnan(self.times[0]) and self.times[0] != 0
+
+    @property
+    def start_time(self):
+        return self.times[0] if self.has_time else None
+
+    @property
+    def metrics(self):
+        """Distances, durations and speeds of the track, computed once"""
+        if self._metrics is None:
+            self._metrics = TrackMetrics(self)
+        return self._metrics
+
+    def take(self, indices):
+        """A track of the points at `indices`"""
+        return Track(self.lats[indices], self.lons[indices], self.times[indices])
+
+    def to_points(self):
+        return [
+            {
+                "time": None if t != t else int(t) if t.is_integer() else t,
+                "latlon": [lat, lon],
+            }
+            for lat, lon, t in zip(
+                self.lats.tolist(), self.lons.tolist(), self.times.tolist()
+            )
+        ]
@@ -0,0 +1,125 @@
+"""Incremental GPX and TCX parsers
+
+Points are read with `iterparse` and every element is dropped from the tree
+once parsed, so memory only grows with the compact columns of the track.
+"""
+
+from array import array
+from datetime import datetime, timezone
+from xml.etree import ElementTree
+
+import numpy as np
+from utils.track import Track
+
+
+class TrackBuilder(object):
+    """Validate points one by one and collect them in typed arrays"""
+
+    def __init__(self, max_points):
+        self.max_points = max_points
+        self.lats = array("d")
+        self.lons = array("d")
+        self.times = array("d")
+
+    def add(self, lat, lon, time):
+        n = len(self.lats) + 1
+        if n > self.max_points:
+            raise ValueError(f"Too many points, more than {self.max_points}")
+        try:
+            lat = float(lat)
+            lon = float(lon)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid coordinates at point {n}")
+        if not -90 <= lat <= 90:
+            raise ValueError(f"Latitude out of range -90.0 90.0 at point {n}")
+        if not -180 <= lon <= 180:
+            raise ValueError(f"Longitude out of range -180.0 180.0 at point {n}")
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.times.append(parse_time(time, n))
+
+    def track(self):
+        if not self.lats:
+            raise ValueError("No track point found")
+        return Track(
+            np.frombuffer(self.lats),
+            np.frombuffer(self.lons),
+            np.frombuffer(self.times),
+        )
+
+
+def parse_time(value, n):
+    if value is None:
+        return np.nan
+    try:
+        dt = datetime.fromisoformat(value.strip())
+    except ValueError:
+        raise ValueError(f"Invalid time at point {n}")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def iter_xml(fileobj):
+    """Yield (event, local name, element) of an XML document, removing each
+    element from its parent once its end has been yielded"""
+    stack = []
+    try:
+        for event, elem in ElementTree.iterparse(fileobj, events=("start", "end")):
+            name = elem.tag.rpartition("}")[2]
+            if event == "start":
+                stack.append(elem)
+                yield event, name, elem
+            else:
+                stack.pop()
+                yield event, name, elem
+                if stack:
+                    stack[-1].remove(elem)
+    except ElementTree.ParseError as e:
+        raise ValueError(f"Invalid XML: {e}")
+
+
+def parse_gpx(fileobj, max_points):
+    builder = TrackBuilder(max_points)
+    point = None
+    for event, name, elem in iter_xml(fileobj):
+        if name == "trkpt":
+            if event == "start":
+                point = [elem.get("lat"), elem.get("lon"), None]
+            else:
+                builder.add(*point)
+                point = None
+        elif name == "time" and event == "end" and point is not None:
+            point[2] = elem.text
+    return builder.track()
+
+
+def parse_tcx(fileobj, max_points):
+    builder = TrackBuilder(max_points)
+    point = None
+    fields = {"LatitudeDegrees": 0, "LongitudeDegrees": 1, "Time": 2}
+    for event, name, elem in iter_xml(fileobj):
+        if name == "Trackpoint":
+            if event == "start":
+                point = [None, None, None]
+            else:
+                # Points without position, eg: heart rate only, are skipped
+                if point[0] is not None and point[1] is not None:
+                    builder.add(*point)
+                point = None
+        elif name in fields and event == "end" and point is not None:
+            point[fields[name]] = elem.text
+    return builder.track()
+
+
+def parse_track_file(fileobj, max_points):
+    """Parse a GPX or a TCX file into a Track, raise ValueError if invalid"""
+    head = fileobj.read(4096)
+    fileobj.seek(0)
+    if isinstance(head, str):
+        head = head.encode("utf-8")
+    if b"TrainingCenterDatabase" in head:
+        return parse_tcx(fileobj, max_points)
+    if b"<gpx" in head:
+        return parse_gpx(fileobj, max_points)
+    raise ValueError("Unsupported file, expecting GPX or TCX")
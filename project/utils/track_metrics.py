@@ -0,0 +1,74 @@
+"""Vectorized metrics of a route track
+
+Same haversine formula and earth diameter as jstools/drawHelpers.js, so that
+distances match the ones printed on the route images.
+"""
+
+import math
+
+import numpy as np
+
+EARTH_DIAMETER = 12756274
+# Below that speed, in m/s, a segment does not count in the moving time
+MOVING_SPEED_THRESHOLD = 0.5
+
+
+def segments_distance(lats, lons):
+    """Distance in meters between each pair of consecutive points"""
+    c = math.pi / 180
+    dlat = np.diff(lats)
+    dlon = np.diff(lons)
+    a = (
+        np.sin(c * dlat / 2) ** 2
+        + np.cos(c * lats[1:]) * np.cos(c * lats[:-1]) * np.sin(c * dlon / 2) ** 2
+    )
+    return EARTH_DIAMETER * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class TrackMetrics(object):
+    """Per point and per segment arrays of a track and their totals
+
+    Segment arrays have one item less than the track, segment `i` going
+    from point `i` to point `i + 1`. Durations, speeds and paces are NaN
+    where a time is unknown.
+    """
+
+    def __init__(self, track):
+        self.point_count = len(track)
+        self.segment_distances = segments_distance(track.lats, track.lons)
+        self.cumulative_distances = np.concatenate(
+            ([0.0], np.cumsum(self.segment_distances))
+        )
+        self.segment_durations = np.diff(track.times)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # m/s and s/km
+            self.segment_speeds = self.segment_distances / self.segment_durations
+            self.segment_paces = 1e3 / self.segment_speeds
+        moving = self.segment_speeds > MOVING_SPEED_THRESHOLD
+        self.moving_time = float(self.segment_durations[moving].sum())
+        if self.point_count:
+            self.distance = float(self.cumulative_distances[-1])
+            # Points may lack a time, eg: in GPX files
+            known_times = track.times[~np.isnan(track.times) & (track.times != 0)]
+            if len(known_times):
+                self.duration = float(known_times[-1] - known_times[0])
+            else:
+                self.duration = math.nan
+            self.bbox = {
+                "north": float(track.lats.max()),
+                "south": float(track.lats.min()),
+                "east": float(track.lons.max()),
+                "west": float(track.lons.min()),
+            }
+        else:
+            self.distance = 0.0
+            self.duration = math.nan
+            self.bbox = None
+
+    @property
+    def average_speed(self):
+        """Average moving speed in m/s"""
+        if not self.moving_time:
+            return math.nan
+        moving = self.segment_speeds > MOVING_SPEED_THRESHOLD
+        return float(self.segment_distances[moving].sum() / self.moving_time)
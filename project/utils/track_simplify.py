@@ -0,0 +1,76 @@
+"""Douglas-Peucker simplification of route tracks
+
+A single pass ranks the points of a track by the tolerance, in meters, up
+to which Douglas-Peucker keeps them, so that any level of detail is then a
+simple selection. Kept points keep their times.
+"""
+
+import math
+
+import numpy as np
+
+EARTH_RADIUS = 6378137
+
+
+def to_local_meters(lats, lons):
+    """Equirectangular projection around the track mean latitude"""
+    c = math.pi / 180
+    lat0 = np.mean(lats) if len(lats) else 0
+    xs = EARTH_RADIUS * c * lons * math.cos(c * lat0)
+    ys = EARTH_RADIUS * c * lats
+    return xs, ys
+
+
+def segment_distances(xs, ys, first, last):
+    """Distance of the points between `first` and `last` to their segment"""
+    px = xs[first + 1 : last]
+    py = ys[first + 1 : last]
+    dx = xs[last] - xs[first]
+    dy = ys[last] - ys[first]
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return np.hypot(px - xs[first], py - ys[first])
+    return np.abs(dy * (px - xs[first]) - dx * (py - ys[first])) / length
+
+
+def douglas_peucker_ranks(lats, lons, min_tolerance):
+    """Return the indices of the points kept for `min_tolerance` and the
+    largest tolerance for which each of them is kept
+
+    Douglas-Peucker with tolerance `t >= min_tolerance` keeps exactly the
+    points ranked above `t`. The first and last points rank infinite.
+    """
+    n = len(lats)
+    ranks = np.zeros(n)
+    if n:
+        ranks[0] = ranks[-1] = np.inf
+    xs, ys = to_local_meters(np.asarray(lats), np.asarray(lons))
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, parent_rank = stack.pop()
+        if last - first < 2:
+            continue
+        distances = segment_distances(xs, ys, first, last)
+        i = int(np.argmax(distances))
+        if distances[i] <= min_tolerance:
+            continue
+        split = first + 1 + i
+        # A point is only reached once its parents are kept
+        ranks[split] = min(distances[i], parent_rank)
+        stack.append((first, split, ranks[split]))
+        stack.append((split, last, ranks[split]))
+    indices = np.flatnonzero(ranks)
+    return indices, ranks[indices]
+
+
+def select_points(indices, ranks, tolerance=None, max_points=None):
+    """Indices of the points of a level of detail, a tolerance in meters
+    and/or a maximum number of points"""
+    if tolerance is not None:
+        keep = ranks > tolerance
+        indices = indices[keep]
+        ranks = ranks[keep]
+    if max_points is not None and len(indices) > max_points:
+        best = np.argsort(-ranks, kind="stable")[: max(max_points, 2)]
+        indices = indices[np.sort(best)]
+    return indices